@@ -1,79 +1,257 @@
+import asyncio
+import io
+import mimetypes
 import os
+import time
 import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Optional
 
-from flask import Flask, jsonify, request, send_from_directory, render_template
+import httpx
+import orjson
+from quart import Quart, Response, jsonify, request, send_from_directory, render_template
+from quart.json.provider import DefaultJSONProvider
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
-from .config import AppConfig
+try:
+    # SIMD-accelerated decoder; the stdlib module is API compatible
+    import pybase64 as base64
+except Exception:
+    import base64
+
+try:
+    import uvloop
+    _HAS_UVLOOP = True
+except Exception:
+    _HAS_UVLOOP = False
+
+from .config import get_config
 from .services.auth import require_firebase_auth
 from .services.db import db_create_analysis, db_get_user_history, db_get_analysis, db_update_analysis_video
 from .services.weather import fetch_weather_snapshot
 from .services.story import generate_soil_story
 from .services.video import generate_story_video
-from .ml.soil_analyzer import analyze_image_bytes
+from .ml.soil_analyzer import analyze_image_bytes, warm_up as warm_up_analyzer
+
+
+# Video renders are CPU-bound ffmpeg jobs, so they run in worker
+# processes and are tracked here by job id until the client collects them.
+# Finished jobs nobody polls for are dropped after _VIDEO_JOB_TTL seconds.
+_VIDEO_JOB_TTL = 3600
+_video_executor = None
+_video_jobs = {}
+
+
+def _get_video_executor() -> ProcessPoolExecutor:
+    global _video_executor
+    if _video_executor is None:
+        _video_executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _video_executor
+
+
+def _copy_upload(stream, dest: Path) -> Optional[bytes]:
+    """Copy a disk-spooled upload to ``dest`` in-kernel and return its bytes.
+
+    Large multipart uploads are spooled to a real temp file, so the copy can
+    use sendfile(2) without passing through Python. Returns None when the
+    stream has no file descriptor (small in-memory uploads) or the platform
+    can't sendfile between regular files, leaving the caller to write it.
+    """
+    if not hasattr(os, 'sendfile'):
+        return None
+    try:
+        src_fd = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    size = os.fstat(src_fd).st_size
+    dst_fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    except OSError:
+        return None
+    finally:
+        os.close(dst_fd)
+    return os.pread(src_fd, size, 0)
+
+
+async def _discard_upload(path: Path, save_task: Optional[asyncio.Future]) -> None:
+    """Remove an upload no record points to, once any pending write lands"""
+    if save_task is not None:
+        try:
+            await save_task
+        except Exception:
+            pass
+    await asyncio.to_thread(path.unlink, missing_ok=True)
+
+
+def _prune_video_jobs() -> None:
+    cutoff = time.monotonic() - _VIDEO_JOB_TTL
+    for job_id, job in list(_video_jobs.items()):
+        if job.get('finishedAt', cutoff) < cutoff:
+            _video_jobs.pop(job_id, None)
+
+
+def _on_video_done(job_id: str, analysis_id: str, fut: Future) -> None:
+    job = _video_jobs.get(job_id)
+    if job is not None:
+        job['finishedAt'] = time.monotonic()
+    if fut.cancelled() or fut.exception() is not None:
+        return
+    video_path, public_url = fut.result()
+    try:
+        db_update_analysis_video(analysis_id, {
+            "videoPath": video_path,
+            "videoUrl": public_url,
+        })
+    except Exception as e:
+        print(f"Failed to store video for {analysis_id}: {e}")
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for request parsing and jsonify"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
+def make_serializer(*fields: str):
+    """Build a positional JSON response writer for a fixed response shape.
+
+    The returned callable takes one value per field, in order, and returns an
+    ``application/json`` Response produced by a single ``orjson.dumps`` call.
+    """
+    def serialize(*values) -> Response:
+        body = orjson.dumps(dict(zip(fields, values)), option=orjson.OPT_NON_STR_KEYS)
+        return Response(body, mimetype='application/json')
+    serialize.__name__ = f"serialize_{'_'.join(fields)}"
+    return serialize
+
+
+_ser_analyze = make_serializer("id", "imagePath", "analysis", "weather", "story")
+_ser_video_done = make_serializer("jobId", "status", "analysisId", "videoPath", "videoUrl")
+_ser_history = make_serializer("items")
+
+
+def create_app() -> Quart:
+    if _HAS_UVLOOP:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
-def create_app() -> Flask:
     # Load environment variables from .env if present
     try:
         from dotenv import load_dotenv
         load_dotenv()
     except Exception:
         pass
-    app = Flask(
+    app = Quart(
         __name__,
         template_folder=str(Path(__file__).resolve().parents[1] / 'frontend' / 'templates'),
         static_folder=str(Path(__file__).resolve().parents[1] / 'frontend' / 'static'),
         static_url_path='/static'
     )
-    app.config.from_object(AppConfig())
+    app.config.from_object(get_config())
+    app.json = ORJSONProvider(app)
 
     uploads_dir = Path(app.config['UPLOADS_DIR'])
     media_dir = Path(app.config['MEDIA_DIR'])
     uploads_dir.mkdir(parents=True, exist_ok=True)
     media_dir.mkdir(parents=True, exist_ok=True)
 
+    # Compile the analyzer kernels now so the first upload doesn't pay for it
+    warm_up_analyzer()
+
+    # One pooled HTTP/2 client for outbound API calls (weather, LLMs), so
+    # steady-state requests reuse open TLS connections
+    @app.before_serving
+    async def size_io_pool():
+        # Blocking storage/SDK calls run via asyncio.to_thread; the stock
+        # executor caps at cpu_count + 4 threads, which I/O-bound calls
+        # saturate long before the CPU is busy
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=app.config['IO_THREADS'], thread_name_prefix='io')
+        )
+
+    @app.before_serving
+    async def open_http_client():
+        app.extensions['http'] = httpx.AsyncClient(
+            http2=True,
+            timeout=10,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        )
+
+    @app.after_serving
+    async def close_http_client():
+        client = app.extensions.pop('http', None)
+        if client is not None:
+            await client.aclose()
+
     @app.get('/health')
-    def health():
+    async def health():
         return jsonify({"status": "ok"})
 
     @app.get('/')
-    def index():
-        return render_template('index.html')
+    async def index():
+        return await render_template('index.html')
 
     @app.get('/history')
-    def history_page():
-        return render_template('history.html')
+    async def history_page():
+        return await render_template('history.html')
 
     @app.post('/api/analyze')
     @require_firebase_auth
-    def api_analyze(user):
+    async def api_analyze(user):
+        # doc_id is set once a record references the upload; any other exit
+        # removes the file so failed requests don't leave orphans
+        saved_path = None
+        save_task = None
+        doc_id = None
         try:
+            # Dispatch once on content type and parse the body exactly once
+            if request.mimetype == 'multipart/form-data':
+                fields = await request.form
+                files = await request.files
+            else:
+                fields = await request.get_json(force=True, silent=True) or {}
+                files = None
+
             # Accept either file upload or base64 in JSON
-            if 'photo' in request.files:
-                image_file = request.files['photo']
+            if files is not None and 'photo' in files:
+                image_file = files['photo']
                 filename = secure_filename(image_file.filename) or f"soil_{uuid.uuid4().hex}.jpg"
                 saved_path = uploads_dir / filename
-                image_file.save(saved_path)
-                with open(saved_path, 'rb') as f:
-                    image_bytes = f.read()
+                image_bytes = await asyncio.to_thread(_copy_upload, image_file.stream, saved_path)
+                saved = image_bytes is not None
+                if not saved:
+                    image_bytes = image_file.stream.read()
             else:
-                payload = request.get_json(silent=True) or {}
-                b64_data = payload.get('imageBase64')
+                b64_data = fields.get('imageBase64')
                 if not b64_data:
                     return jsonify({"error": "No image provided"}), 400
-                import base64
-                image_bytes = base64.b64decode(b64_data.split(',')[-1])
+                image_bytes = base64.b64decode(b64_data[b64_data.rfind(',') + 1:])
                 filename = f"soil_{uuid.uuid4().hex}.jpg"
                 saved_path = uploads_dir / filename
-                with open(saved_path, 'wb') as f:
-                    f.write(image_bytes)
+                saved = False
+
+            # Write the upload to disk in the background; it only has to land
+            # before the record referencing it is persisted.
+            if not saved:
+                save_task = asyncio.ensure_future(asyncio.to_thread(saved_path.write_bytes, image_bytes))
 
             # Location
-            lat = request.form.get('lat') or (request.get_json(silent=True) or {}).get('lat')
-            lon = request.form.get('lon') or (request.get_json(silent=True) or {}).get('lon')
+            lat = fields.get('lat')
+            lon = fields.get('lon')
             if lat is not None and lon is not None:
                 try:
                     lat = float(lat)
@@ -84,16 +262,21 @@ def create_app() -> Flask:
                 lat = None
                 lon = None
 
-            # ML analysis
-            analysis = analyze_image_bytes(image_bytes)
-
-            # Weather snapshot
-            weather = None
+            # ML analysis and weather snapshot are independent, so run them concurrently
+            http_client = app.extensions.get('http')
             if lat is not None and lon is not None:
-                weather = fetch_weather_snapshot(lat, lon)
+                analysis, weather = await asyncio.gather(
+                    asyncio.to_thread(analyze_image_bytes, image_bytes),
+                    fetch_weather_snapshot(lat, lon, client=http_client),
+                )
+            else:
+                analysis = await asyncio.to_thread(analyze_image_bytes, image_bytes)
+                weather = None
 
             # AI story
-            story_text = generate_soil_story(analysis=analysis, weather=weather, location={"lat": lat, "lon": lon})
+            story_text = await generate_soil_story(
+                analysis=analysis, weather=weather, location={"lat": lat, "lon": lon}, http_client=http_client
+            )
 
             # Persist to local storage
             record = {
@@ -105,28 +288,27 @@ def create_app() -> Flask:
                 "weather": weather,
                 "story": story_text,
             }
-            doc_id = db_create_analysis(record)
+            if save_task is not None:
+                await save_task
+            doc_id = await asyncio.to_thread(db_create_analysis, record)
 
-            return jsonify({
-                "id": doc_id,
-                "imagePath": record["imagePath"],
-                "analysis": analysis,
-                "weather": weather,
-                "story": story_text,
-            })
+            return _ser_analyze(doc_id, record["imagePath"], analysis, weather, story_text)
         except Exception as e:
             return jsonify({"error": str(e)}), 500
+        finally:
+            if doc_id is None and saved_path is not None:
+                await _discard_upload(saved_path, save_task)
 
     @app.post('/api/video')
     @require_firebase_auth
-    def api_video(user):
+    async def api_video(user):
         try:
-            data = request.get_json(force=True)
+            data = await request.get_json(force=True)
             analysis_id = data.get('analysisId')
             if not analysis_id:
                 return jsonify({"error": "analysisId is required"}), 400
 
-            doc = db_get_analysis(analysis_id)
+            doc = await asyncio.to_thread(db_get_analysis, analysis_id)
             if not doc:
                 return jsonify({"error": "Analysis not found"}), 404
             if doc.get('userId') != user['uid']:
@@ -137,33 +319,64 @@ def create_app() -> Flask:
             if not image_path or not story_text:
                 return jsonify({"error": "Record missing image or story"}), 400
 
-            video_path, public_url = generate_story_video(story_text=story_text, image_path=image_path)
-
-            db_update_analysis_video(analysis_id, {
-                "videoPath": video_path,
-                "videoUrl": public_url,
-            })
+            _prune_video_jobs()
+            fut = _get_video_executor().submit(generate_story_video, story_text, image_path)
+            job_id = uuid.uuid4().hex
+            _video_jobs[job_id] = {"userId": user['uid'], "analysisId": analysis_id, "future": fut}
+            fut.add_done_callback(lambda f: _on_video_done(job_id, analysis_id, f))
 
-            return jsonify({
-                "videoPath": video_path,
-                "videoUrl": public_url,
-            })
+            return jsonify({"jobId": job_id, "status": "pending"}), 202
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    @app.get('/api/video/<job_id>')
+    @require_firebase_auth
+    async def api_video_status(user, job_id):
+        job = _video_jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        if job['userId'] != user['uid']:
+            return jsonify({"error": "Forbidden"}), 403
+
+        fut = job['future']
+        if not fut.done():
+            return jsonify({"jobId": job_id, "status": "pending"}), 202
+
+        _video_jobs.pop(job_id, None)
+        error = fut.exception() if not fut.cancelled() else RuntimeError("Job cancelled")
+        if error is not None:
+            return jsonify({"jobId": job_id, "status": "error", "error": str(error)}), 500
+
+        video_path, public_url = fut.result()
+        return _ser_video_done(job_id, "done", job['analysisId'], video_path, public_url)
+
     @app.get('/api/history')
     @require_firebase_auth
-    def api_history(user):
+    async def api_history(user):
         try:
-            items = db_get_user_history(user['uid'])
-            return jsonify({"items": items})
+            items = await asyncio.to_thread(db_get_user_history, user['uid'])
+            return _ser_history(items)
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     # Serve saved media if using local storage
     @app.get('/media/<path:filename>')
-    def serve_media(filename):
-        return send_from_directory(media_dir, filename, as_attachment=False)
+    async def serve_media(filename):
+        accel_prefix = app.config.get('MEDIA_ACCEL_PREFIX')
+        if accel_prefix:
+            media_path = safe_join(str(media_dir), filename)
+            if media_path is None or not os.path.isfile(media_path):
+                return jsonify({"error": "Not found"}), 404
+            # Let nginx stream the file with sendfile(2) instead of Python
+            resp = Response(b'', mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+            resp.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        # Videos are re-rendered under the same name, so revalidate via ETag
+        # rather than marking them immutable
+        resp = await send_from_directory(media_dir, filename, as_attachment=False, conditional=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
 
     return app
 
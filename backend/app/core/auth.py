@@ -1,6 +1,7 @@
+import asyncio
 from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.core.firebase import verify_token, get_user_by_uid
+from app.core.firebase import get_cached_token, verify_token, get_user_by_uid
 from typing import Optional, Dict, Any
 
 # Security scheme for Swagger UI
@@ -21,8 +22,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     """
     try:
         token = credentials.credentials
-        # Verify the token with Firebase
-        decoded_token = verify_token(token)
+        # Recently verified tokens are served from memory; otherwise verify
+        # the token with Firebase off the event loop
+        decoded_token = get_cached_token(token) or await asyncio.to_thread(verify_token, token)
         
         # Get additional user info if needed
         user_id = decoded_token.get("uid")
@@ -38,6 +40,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         
         # Return the decoded token which contains user info
         return decoded_token
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -45,6 +49,21 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def get_current_user_id(current_user: Dict[str, Any] = Depends(get_current_user)) -> str:
+    """
+    Dependency returning just the authenticated user's ID
+    
+    get_current_user already rejects tokens without a uid, so handlers that
+    only need the ID can take it directly instead of re-checking the claims.
+    
+    Args:
+        current_user: The authenticated user from get_current_user dependency
+        
+    Returns:
+        The user's Firebase UID
+    """
+    return current_user["uid"]
+
 async def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[Dict[str, Any]]:
     """
     Dependency to get the current user if authenticated, but doesn't require authentication
@@ -60,7 +79,7 @@ async def get_optional_user(authorization: Optional[str] = Header(None)) -> Opti
         
     try:
         token = authorization.replace("Bearer ", "")
-        decoded_token = verify_token(token)
+        decoded_token = get_cached_token(token) or await asyncio.to_thread(verify_token, token)
         return decoded_token
     except Exception:
         return None
@@ -0,0 +1,149 @@
+import functools
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Caching is optional; handlers run uncached without redis
+    aioredis = None
+
+# Shared Redis connection, opened in the application lifespan
+_redis = None
+
+# Finished analyses rarely change, so keep them for a day. The key has its
+# own namespace so the soil prefix sweeps on every write don't drop it;
+# deleting the entry unlinks it explicitly.
+ANALYSIS_CACHE_TTL = 86400
+
+
+def analysis_key(user_id: str, entry_id: str) -> str:
+    """Redis key holding a soil entry's analysis results"""
+    return f"analysis:{user_id}:{entry_id}"
+
+
+async def init_cache() -> None:
+    """Connect to Redis if REDIS_URL is configured"""
+    global _redis
+    if not settings.REDIS_URL or aioredis is None:
+        return
+    try:
+        _redis = aioredis.from_url(settings.REDIS_URL)
+        await _redis.ping()
+    except Exception as e:
+        logger.warning("Response cache disabled, could not connect to Redis: %s", e)
+        _redis = None
+
+
+async def close_cache() -> None:
+    """Close the Redis connection"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+
+def _build_key(namespace: str, scope: str, func_name: str, params: Dict[str, Any]) -> str:
+    query = "&".join(f"{name}={params[name]}" for name in sorted(params))
+    return f"{namespace}:{scope}:{func_name}:{query}"
+
+
+def cached_response(namespace: str, scope_param: str = "user_id", expire: Optional[int] = None):
+    """Cache a GET handler's JSON-encoded result in Redis
+
+    Keys look like ``{namespace}:{scope}:{handler}:{params}``, where scope is
+    the handler's ``scope_param`` argument: the caller's ``user_id`` by
+    default, or the owning user's ID when the resource belongs to someone
+    else. Writes can then drop a user's entries with :func:`invalidate`.
+
+    On a hit the cached JSON is returned as plain data and FastAPI
+    validates it against the route's response_model as usual.
+
+    Args:
+        namespace: Top-level key prefix, e.g. "soil", "story" or "user"
+        scope_param: Handler argument holding the owning user's ID
+        expire: TTL in seconds, defaults to CACHE_TTL_SECONDS
+    """
+    def decorator(func: Callable):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _redis is None:
+                return await func(*args, **kwargs)
+
+            scope = kwargs.get(scope_param)
+            if not scope:
+                return await func(*args, **kwargs)
+
+            params = {k: v for k, v in kwargs.items() if k != "current_user" and k != scope_param}
+            key = _build_key(namespace, scope, func.__name__, params)
+            try:
+                cached = await _redis.get(key)
+                if cached is not None:
+                    return orjson.loads(cached)
+            except Exception as e:
+                logger.warning("Cache read failed for %s: %s", key, e)
+
+            result = await func(*args, **kwargs)
+            try:
+                payload = orjson.dumps(jsonable_encoder(result))
+                await _redis.set(key, payload, ex=expire or settings.CACHE_TTL_SECONDS)
+            except Exception as e:
+                logger.warning("Cache write failed for %s: %s", key, e)
+            return result
+        return wrapper
+    return decorator
+
+
+async def cache_get(key: str) -> Optional[Any]:
+    """Return the JSON value stored under key, or None on a miss"""
+    if _redis is None:
+        return None
+    try:
+        cached = await _redis.get(key)
+        return orjson.loads(cached) if cached is not None else None
+    except Exception as e:
+        logger.warning("Cache read failed for %s: %s", key, e)
+        return None
+
+
+async def cache_set(key: str, value: Any, expire: Optional[int] = None) -> None:
+    """Store a JSON-encodable value under key"""
+    if _redis is None:
+        return
+    try:
+        await _redis.set(key, orjson.dumps(jsonable_encoder(value)), ex=expire or settings.CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("Cache write failed for %s: %s", key, e)
+
+
+async def cache_delete(*keys: str) -> None:
+    """Delete the given keys"""
+    if _redis is None or not keys:
+        return
+    try:
+        await _redis.unlink(*keys)
+    except Exception as e:
+        logger.warning("Cache delete failed for %s: %s", keys, e)
+
+
+async def invalidate(prefixes: Iterable[str]) -> None:
+    """Delete every cached response whose key starts with one of the prefixes
+
+    Args:
+        prefixes: Key prefixes such as ``f"soil:{user_id}:"``
+    """
+    if _redis is None:
+        return
+    try:
+        for prefix in prefixes:
+            keys = [key async for key in _redis.scan_iter(match=f"{prefix}*", count=500)]
+            if keys:
+                await _redis.unlink(*keys)
+    except Exception as e:
+        logger.warning("Cache invalidation failed: %s", e)
@@ -33,12 +33,24 @@ class Settings(BaseModel):
     AI_SERVICE_PROVIDER: str = os.getenv("AI_SERVICE_PROVIDER", "openai")  # openai or gemini
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+    # OpenAI chat models; the analysis model must accept image input
+    OPENAI_ANALYSIS_MODEL: str = os.getenv("OPENAI_ANALYSIS_MODEL", "gpt-4o-mini")
+    OPENAI_STORY_MODEL: str = os.getenv("OPENAI_STORY_MODEL", "gpt-4o-mini")
+    # Outbound rate limits per worker, matched to the provider account tier
+    OPENAI_RPM: int = int(os.getenv("OPENAI_RPM", "500"))
+    OPENAI_TPM: int = int(os.getenv("OPENAI_TPM", "30000"))
+    GEMINI_RPM: int = int(os.getenv("GEMINI_RPM", "1000"))
+    GEMINI_TPM: int = int(os.getenv("GEMINI_TPM", "1000000"))
     
     # Storage settings
     UPLOAD_FOLDER: str = os.getenv("UPLOAD_FOLDER", "uploads")
     MAX_CONTENT_LENGTH: int = 16 * 1024 * 1024  # 16 MB max upload size
     ALLOWED_EXTENSIONS: List[str] = ["jpg", "jpeg", "png"]
     
+    # Response cache settings (disabled when REDIS_URL is empty)
+    REDIS_URL: str = os.getenv("REDIS_URL", "")
+    CACHE_TTL_SECONDS: int = int(os.getenv("CACHE_TTL_SECONDS", "60"))
+    
     # Security settings
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
 
@@ -1,113 +1,333 @@
+import asyncio
 import firebase_admin
-from firebase_admin import credentials, auth, firestore, storage
-import pyrebase
+from firebase_admin import credentials, auth, firestore, firestore_async, storage
+import hashlib
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache, wraps
+from cachetools import TLRUCache, TTLCache
 from fastapi import HTTPException, status
 from app.core.config import settings
-from typing import Dict, Any, Optional
+from typing import BinaryIO, Dict, Any, List, Optional, Tuple, TypedDict, Union
 
-# Initialize Firebase Admin SDK
-try:
+_init_lock = threading.Lock()
+_not_configured = False
+
+def _load_credentials():
     # Try to load from environment variable first (for production)
     if settings.FIREBASE_SERVICE_ACCOUNT_KEY:
         try:
             service_account_info = json.loads(settings.FIREBASE_SERVICE_ACCOUNT_KEY)
-            cred = credentials.Certificate(service_account_info)
+            return credentials.Certificate(service_account_info)
         except json.JSONDecodeError:
             # If it's a file path instead of JSON string
-            cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_KEY)
-    else:
-        # Look for service account file (for development)
-        service_account_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 
-                                          "firebase-service-account.json")
-        if os.path.exists(service_account_path):
-            cred = credentials.Certificate(service_account_path)
-        else:
-            raise FileNotFoundError("Firebase service account file not found")
-    
-    # Initialize the app
-    firebase_admin_app = firebase_admin.initialize_app(cred, {
-        'storageBucket': settings.FIREBASE_STORAGE_BUCKET
-    })
-    
-    # Initialize Firestore
-    db = firestore.client()
+            return credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_KEY)
+    # Look for service account file (for development)
+    service_account_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 
+                                      "firebase-service-account.json")
+    if os.path.exists(service_account_path):
+        return credentials.Certificate(service_account_path)
+    raise FileNotFoundError("Firebase service account file not found")
+
+def _cache_unless_none(factory):
+    """Memoize a client factory, but retry it while it returns None
     
-    # Initialize Storage
-    bucket = storage.bucket()
+    Unlike lru_cache, a None from a transient failure isn't kept, so a
+    later call can still bring the client up.
+    """
+    value = None
+    lock = threading.Lock()
     
-except Exception as e:
-    print(f"Error initializing Firebase Admin SDK: {e}")
-    # For development, you might want to continue without Firebase
-    firebase_admin_app = None
-    db = None
-    bucket = None
-
-# Initialize Pyrebase for authentication
-firebase_config = {
-    "apiKey": settings.FIREBASE_API_KEY,
-    "authDomain": settings.FIREBASE_AUTH_DOMAIN,
-    "projectId": settings.FIREBASE_PROJECT_ID,
-    "storageBucket": settings.FIREBASE_STORAGE_BUCKET,
-    "messagingSenderId": settings.FIREBASE_MESSAGING_SENDER_ID,
-    "appId": settings.FIREBASE_APP_ID,
-    "measurementId": settings.FIREBASE_MEASUREMENT_ID,
-    "databaseURL": settings.FIREBASE_DATABASE_URL
-}
-
-try:
-    firebase = pyrebase.initialize_app(firebase_config)
-    firebase_auth = firebase.auth()
-except Exception as e:
-    print(f"Error initializing Pyrebase: {e}")
-    firebase = None
-    firebase_auth = None
+    @wraps(factory)
+    def wrapper():
+        nonlocal value
+        if value is None:
+            with lock:
+                if value is None:
+                    value = factory()
+        return value
+    return wrapper
+
+# Firebase clients are created on first use rather than at import, so
+# endpoints that never touch Firestore/Storage don't pay for them.
+@_cache_unless_none
+def get_app():
+    """Initialize the Firebase Admin SDK, or return None if it isn't configured"""
+    global _not_configured
+    if _not_configured:
+        return None
+    with _init_lock:
+        try:
+            # Another thread may have initialized it while we waited
+            return firebase_admin.get_app()
+        except ValueError:
+            pass
+        try:
+            return firebase_admin.initialize_app(_load_credentials(), {
+                'storageBucket': settings.FIREBASE_STORAGE_BUCKET
+            })
+        except FileNotFoundError as e:
+            # No credentials at all won't fix itself; don't retry every call
+            print(f"Error initializing Firebase Admin SDK: {e}")
+            _not_configured = True
+            return None
+        except Exception as e:
+            print(f"Error initializing Firebase Admin SDK: {e}")
+            # For development, you might want to continue without Firebase
+            return None
+
+@_cache_unless_none
+def get_db():
+    """Firestore client, or None when Firebase is unavailable"""
+    if get_app() is None:
+        return None
+    with _init_lock:
+        return firestore.client()
+
+@_cache_unless_none
+def get_async_db():
+    """Shared asyncio Firestore client, or None when Firebase is unavailable"""
+    if get_app() is None:
+        return None
+    with _init_lock:
+        return firestore_async.client()
+
+@_cache_unless_none
+def get_bucket():
+    """Default Storage bucket, or None when Firebase is unavailable"""
+    if get_app() is None:
+        return None
+    with _init_lock:
+        return storage.bucket()
+
+@_cache_unless_none
+def get_batch_engine() -> Optional["FirestoreBatchEngine"]:
+    """Shared write batcher bound to the Firestore client"""
+    db = get_db()
+    return FirestoreBatchEngine(db) if db else None
+
+@lru_cache(maxsize=None)
+def get_firebase_auth():
+    """Pyrebase auth client for client-side sign-in flows"""
+    import pyrebase
+    firebase_config = {
+        "apiKey": settings.FIREBASE_API_KEY,
+        "authDomain": settings.FIREBASE_AUTH_DOMAIN,
+        "projectId": settings.FIREBASE_PROJECT_ID,
+        "storageBucket": settings.FIREBASE_STORAGE_BUCKET,
+        "messagingSenderId": settings.FIREBASE_MESSAGING_SENDER_ID,
+        "appId": settings.FIREBASE_APP_ID,
+        "measurementId": settings.FIREBASE_MEASUREMENT_ID,
+        "databaseURL": settings.FIREBASE_DATABASE_URL
+    }
+    try:
+        return pyrebase.initialize_app(firebase_config).auth()
+    except Exception as e:
+        print(f"Error initializing Pyrebase: {e}")
+        return None
+
+# Decoded ID tokens keyed by a digest of the raw token, so repeat requests
+# with the same token skip signature verification. Entries live for five
+# minutes or until the token's own exp, whichever comes first.
+TOKEN_CACHE_TTL = 300
+
+def _token_ttu(key: bytes, decoded_token: Dict[str, Any], now: float) -> float:
+    return min(now + TOKEN_CACHE_TTL, decoded_token.get("exp", 0))
+
+_token_cache: TLRUCache = TLRUCache(maxsize=10_000, ttu=_token_ttu, timer=time.time)
+_token_cache_lock = threading.Lock()
+# Verifications currently running, so concurrent requests carrying the same
+# token wait on one Firebase call instead of each making their own.
+_token_inflight: Dict[bytes, Future] = {}
 
 # Firebase Authentication Functions
+def _token_key(token: str) -> bytes:
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def get_cached_token(token: str) -> Optional[Dict[str, Any]]:
+    """Return the decoded token if it was verified recently and is unexpired"""
+    with _token_cache_lock:
+        return _token_cache.get(_token_key(token))
+
 def verify_token(token: str) -> Dict[str, Any]:
     """Verify Firebase ID token and return user info"""
+    key = _token_key(token)
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None:
+            return cached
+        pending = _token_inflight.get(key)
+        if pending is None:
+            pending = _token_inflight[key] = Future()
+            leader = True
+        else:
+            leader = False
+    if not leader:
+        return pending.result()
+
     try:
-        decoded_token = auth.verify_id_token(token)
-        return decoded_token
+        decoded_token = auth.verify_id_token(token, app=get_app(), check_revoked=False)
     except Exception as e:
-        raise HTTPException(
+        error = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid authentication credentials: {str(e)}",
             headers={"WWW-Authenticate": "Bearer"},
         )
+        with _token_cache_lock:
+            _token_inflight.pop(key, None)
+        pending.set_exception(error)
+        raise error
 
-def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    with _token_cache_lock:
+        _token_cache[key] = decoded_token
+        _token_inflight.pop(key, None)
+    pending.set_result(decoded_token)
+    return decoded_token
+
+class UserLite(TypedDict):
+    """The user record fields the API actually uses"""
+    uid: str
+    email: Optional[str]
+    admin: bool
+    display_name: Optional[str]
+
+def _to_user_lite(user) -> UserLite:
+    claims = user.custom_claims or {}
+    return UserLite(
+        uid=user.uid,
+        email=user.email,
+        admin=bool(claims.get("admin")),
+        display_name=user.display_name,
+    )
+
+# Recently fetched users by uid; misses and errors are not cached
+_user_cache: TTLCache = TTLCache(maxsize=4096, ttl=60)
+_user_cache_lock = threading.Lock()
+
+def get_user_by_email(email: str) -> Optional[UserLite]:
     """Get user by email from Firebase Auth"""
     try:
-        user = auth.get_user_by_email(email)
-        return user.__dict__
+        user = auth.get_user_by_email(email, app=get_app())
+        return _to_user_lite(user)
     except auth.UserNotFoundError:
         return None
     except Exception as e:
         print(f"Error getting user by email: {e}")
         return None
 
-def get_user_by_uid(uid: str) -> Optional[Dict[str, Any]]:
+def get_user_by_uid(uid: str) -> Optional[UserLite]:
     """Get user by UID from Firebase Auth"""
+    with _user_cache_lock:
+        cached = _user_cache.get(uid)
+    if cached is not None:
+        return cached
     try:
-        user = auth.get_user(uid)
-        return user.__dict__
+        user = _to_user_lite(auth.get_user(uid, app=get_app()))
     except auth.UserNotFoundError:
         return None
     except Exception as e:
         print(f"Error getting user by UID: {e}")
         return None
+    with _user_cache_lock:
+        _user_cache[uid] = user
+    return user
+
+class FirestoreBatchEngine:
+    """Coalesce writes from concurrent requests into Firestore batch commits.
+
+    Callers enqueue (op, collection, document_id, data) and receive a Future.
+    A daemon thread drains whatever is queued (up to ``max_batch`` ops or
+    ``flush_interval`` seconds after the first op), commits it as one batch
+    and resolves the futures. If a batch fails, its ops are retried one by one
+    so a single bad write doesn't fail its neighbours.
+    """
+
+    def __init__(self, client, max_batch: int = 100, flush_interval: float = 0.005):
+        self._client = client
+        self._max_batch = max_batch
+        self._flush_interval = flush_interval
+        self._queue: "queue.Queue[Tuple[str, str, str, Dict[str, Any], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, op: str, collection: str, document_id: str, data: Dict[str, Any]) -> Future:
+        """Queue a ``set`` or ``update`` and return a Future resolved after commit"""
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((op, collection, document_id, data, fut))
+        return fut
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="firestore-batch", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            ops = [self._queue.get()]
+            deadline = time.monotonic() + self._flush_interval
+            while len(ops) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    ops.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(ops)
+
+    def _apply(self, writer, op: str, collection: str, document_id: str, data: Dict[str, Any]) -> None:
+        doc_ref = self._client.collection(collection).document(document_id)
+        if op == "set":
+            writer.set(doc_ref, data)
+        else:
+            writer.update(doc_ref, data)
+
+    def _commit(self, ops: List[Tuple[str, str, str, Dict[str, Any], Future]]) -> None:
+        try:
+            batch = self._client.batch()
+            for op, collection, document_id, data, _ in ops:
+                self._apply(batch, op, collection, document_id, data)
+            batch.commit()
+        except Exception:
+            for op, collection, document_id, data, fut in ops:
+                try:
+                    single = self._client.batch()
+                    self._apply(single, op, collection, document_id, data)
+                    single.commit()
+                    fut.set_result(document_id)
+                except Exception as e:
+                    fut.set_exception(e)
+            return
+        for _, _, document_id, _, fut in ops:
+            fut.set_result(document_id)
+
+
+# Upper bound on how long a request waits for its queued write to commit
+WRITE_TIMEOUT = 30
 
 # Firestore Functions
-def get_document(collection: str, document_id: str) -> Optional[Dict[str, Any]]:
-    """Get a document from Firestore"""
+# Reads use the shared AsyncClient; writes go through the batch engine and
+# are awaited without tying up a thread while the batch commits.
+def _require_async_db():
+    db = get_async_db()
     if not db:
         raise HTTPException(status_code=503, detail="Database not available")
+    return db
+
+async def get_document(collection: str, document_id: str) -> Optional[Dict[str, Any]]:
+    """Get a document from Firestore"""
+    db = _require_async_db()
     
     try:
-        doc_ref = db.collection(collection).document(document_id)
-        doc = doc_ref.get()
+        doc = await db.collection(collection).document(document_id).get()
         if doc.exists:
             return doc.to_dict()
         return None
@@ -115,79 +335,131 @@ def get_document(collection: str, document_id: str) -> Optional[Dict[str, Any]]:
         print(f"Error getting document: {e}")
         return None
 
-def add_document(collection: str, data: Dict[str, Any], document_id: Optional[str] = None) -> str:
+def new_document_id(collection: str) -> str:
+    """Generate an ID for a document that hasn't been written yet"""
+    return _require_async_db().collection(collection).document().id
+
+async def add_document(collection: str, data: Dict[str, Any], document_id: Optional[str] = None) -> str:
     """Add a document to Firestore"""
-    if not db:
-        raise HTTPException(status_code=503, detail="Database not available")
+    db = _require_async_db()
     
     try:
-        if document_id:
-            doc_ref = db.collection(collection).document(document_id)
-            doc_ref.set(data)
-            return document_id
-        else:
-            doc_ref = db.collection(collection).add(data)
-            return doc_ref[1].id
+        if not document_id:
+            document_id = new_document_id(collection)
+        write = get_batch_engine().submit("set", collection, document_id, data)
+        return await asyncio.wait_for(asyncio.wrap_future(write), WRITE_TIMEOUT)
     except Exception as e:
         print(f"Error adding document: {e}")
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-def update_document(collection: str, document_id: str, data: Dict[str, Any]) -> bool:
+async def update_document(collection: str, document_id: str, data: Dict[str, Any]) -> bool:
     """Update a document in Firestore"""
-    if not db:
-        raise HTTPException(status_code=503, detail="Database not available")
+    _require_async_db()
     
     try:
-        doc_ref = db.collection(collection).document(document_id)
-        doc_ref.update(data)
+        write = get_batch_engine().submit("update", collection, document_id, data)
+        await asyncio.wait_for(asyncio.wrap_future(write), WRITE_TIMEOUT)
         return True
     except Exception as e:
         print(f"Error updating document: {e}")
         return False
 
-def delete_document(collection: str, document_id: str) -> bool:
+async def batch_write(ops: List[Tuple[str, str, str, Dict[str, Any]]]) -> None:
+    """Commit several writes atomically in one Firestore batch
+    
+    Each op is ``(op, collection, document_id, data)`` with op ``"set"`` or
+    ``"update"``; use :func:`new_document_id` to create documents. Unlike
+    the batch engine, which may split a failed batch into single writes,
+    either every op commits or none do.
+    """
+    db = _require_async_db()
+    
+    try:
+        batch = db.batch()
+        for op, collection, document_id, data in ops:
+            doc_ref = db.collection(collection).document(document_id)
+            if op == "set":
+                batch.set(doc_ref, data)
+            else:
+                batch.update(doc_ref, data)
+        await asyncio.wait_for(batch.commit(), WRITE_TIMEOUT)
+    except Exception as e:
+        print(f"Error committing batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+async def delete_document(collection: str, document_id: str) -> bool:
     """Delete a document from Firestore"""
-    if not db:
-        raise HTTPException(status_code=503, detail="Database not available")
+    db = _require_async_db()
     
     try:
-        doc_ref = db.collection(collection).document(document_id)
-        doc_ref.delete()
+        await db.collection(collection).document(document_id).delete()
         return True
     except Exception as e:
         print(f"Error deleting document: {e}")
         return False
 
-def query_collection(collection: str, field: str, operator: str, value: Any, limit: int = 100) -> list:
-    """Query a collection in Firestore"""
-    if not db:
-        raise HTTPException(status_code=503, detail="Database not available")
+async def query_collection(collection: str, field: str, operator: str, value: Any, limit: int = 100,
+                           fields: Optional[List[str]] = None,
+                           order_by: Optional[Tuple[str, str]] = None) -> list:
+    """Query a collection in Firestore
+    
+    ``fields`` projects the results to those field paths (server-side
+    select), and each result carries its document ID as ``id``.
+    ``order_by`` is a ``(field, "ASCENDING" | "DESCENDING")`` pair applied
+    before the limit; combined with an equality filter it needs a composite
+    index on (field, order field), see firestore.indexes.json.
+    
+    Query failures (e.g. a missing index) raise rather than looking like
+    an empty result.
+    """
+    db = _require_async_db()
     
     try:
-        query = db.collection(collection).where(field, operator, value).limit(limit)
-        results = query.stream()
-        return [doc.to_dict() for doc in results]
+        query = db.collection(collection).where(field, operator, value)
+        if order_by:
+            order_field, direction = order_by
+            query = query.order_by(order_field, direction=direction)
+        if fields:
+            query = query.select(fields)
+        query = query.limit(limit)
+        return [{"id": doc.id, **doc.to_dict()} async for doc in query.stream()]
     except Exception as e:
-        print(f"Error querying collection: {e}")
-        return []
+        print(f"Error querying collection {collection}: {e}")
+        raise HTTPException(status_code=500, detail=f"Database query error: {str(e)}")
 
 # Firebase Storage Functions
-def upload_file(file_data: bytes, destination_path: str) -> str:
-    """Upload a file to Firebase Storage"""
+def upload_file(file_data: Union[bytes, BinaryIO], destination_path: str, content_type: Optional[str] = None) -> str:
+    """Upload a file to Firebase Storage
+    
+    ``file_data`` may be bytes or a binary file object; file objects are
+    rewound and streamed in chunks rather than read into memory.
+    """
+    bucket = get_bucket()
     if not bucket:
         raise HTTPException(status_code=503, detail="Storage not available")
     
     try:
         blob = bucket.blob(destination_path)
-        blob.upload_from_string(file_data)
+        if isinstance(file_data, (bytes, bytearray)):
+            blob.upload_from_string(file_data, content_type=content_type)
+        else:
+            blob.upload_from_file(file_data, rewind=True, content_type=content_type)
         blob.make_public()
         return blob.public_url
     except Exception as e:
         print(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail=f"Storage error: {str(e)}")
 
+def get_public_url(destination_path: str) -> str:
+    """Public URL a file will have once uploaded (computed locally)"""
+    bucket = get_bucket()
+    if not bucket:
+        raise HTTPException(status_code=503, detail="Storage not available")
+    return bucket.blob(destination_path).public_url
+
 def delete_file(file_path: str) -> bool:
     """Delete a file from Firebase Storage"""
+    bucket = get_bucket()
     if not bucket:
         raise HTTPException(status_code=503, detail="Storage not available")
     
@@ -0,0 +1,45 @@
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Handlers run on the listener's thread; request code only enqueues records
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def start_logging(level: int = logging.INFO) -> None:
+    """Send root logger records through a queue to a background thread
+
+    The root logger's existing handlers (or a stderr handler if it has none)
+    are moved behind a QueueListener, so formatting and writing a record
+    never block the event loop.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    if not handlers:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers = [stream_handler]
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
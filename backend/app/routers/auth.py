@@ -2,8 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Body
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Dict, Any
 
-from app.core.firebase import firebase_auth, verify_token
-from app.core.auth import get_current_user
+from app.core.firebase import verify_token
+from app.core.auth import get_current_user_id
 from app.schemas.user import UserCreate, UserResponse, UserInDB
 from app.services.db_service import db_service
 
@@ -69,24 +69,16 @@ async def verify_auth_token(credentials: HTTPAuthorizationCredentials = Depends(
         )
 
 @router.get("/auth/me", response_model=UserResponse)
-async def get_current_user_profile(current_user: Dict[str, Any] = Depends(get_current_user)):
+async def get_current_user_profile(user_id: str = Depends(get_current_user_id)):
     """Get the current user's profile
     
     Args:
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         The user's profile
     """
     try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
         # Get user profile from database
         user_profile = await db_service.get_user_profile(user_id)
         
@@ -1,236 +1,207 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body, Query
+import orjson
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Body, Query
+from fastapi.responses import StreamingResponse
 from typing import Dict, Any, List, Optional
 
-from app.core.auth import get_current_user
+from app.core.auth import get_current_user_id
+from app.core.cache import analysis_key, cache_get, cached_response, invalidate
 from app.schemas.story import StoryCreate, StoryUpdate, StoryResponse, StoryGenerationRequest
 from app.services.db_service import db_service
-from app.services.ai_service import ai_service
+from app.services.ai_service import ai_service, story_title
+from app.utils.response_utils import project_fields
 
 router = APIRouter()
 
+async def _get_analysis_results(entry_id: str, user_id: str) -> Dict[str, Any]:
+    # Get soil entry from database
+    entry = await db_service.get_soil_entry(entry_id, user_id)
+    
+    # Check if entry has analysis results; a worker's cached copy of the
+    # entry can predate an analysis that's already in Redis
+    analysis_results = entry.get("analysis_results") or await cache_get(analysis_key(user_id, entry_id))
+    if not analysis_results:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Soil entry does not have analysis results. Please analyze the soil first."
+        )
+    return analysis_results
+
+async def _save_story(story_id: str, entry_id: str, stored: Dict[str, Any], user_id: str) -> None:
+    await db_service.save_linked_story(story_id, entry_id, stored)
+    await invalidate([f"soil:{user_id}:", f"story:{user_id}:"])
+
+def _story_data(story_content: str, story_request: StoryGenerationRequest, analysis_results: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "title": story_title(story_content),
+        "content": story_content,
+        "metadata": {
+            "preferences": story_request.preferences,
+            "analysis_results": analysis_results
+        },
+        "soil_entry_id": story_request.soil_entry_id
+    }
+
 @router.post("/stories", response_model=StoryResponse, status_code=status.HTTP_201_CREATED)
 async def generate_story(
+    background_tasks: BackgroundTasks,
     story_request: StoryGenerationRequest = Body(...),
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Generate a story based on soil analysis results
     
     Args:
         story_request: Story generation request parameters
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         The generated story
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Get soil entry from database
-        entry_id = story_request.soil_entry_id
-        entry = await db_service.get_soil_entry(entry_id, user_id)
-        
-        # Check if entry has analysis results
-        analysis_results = entry.get("analysis_results")
-        if not analysis_results:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Soil entry does not have analysis results. Please analyze the soil first."
-            )
-        
-        # Generate story
-        story_content = await ai_service.generate_story(analysis_results, story_request.preferences)
-        
-        # Create story title from the first line if it starts with #
-        title = None
-        content_lines = story_content.split('\n')
-        if content_lines and content_lines[0].startswith('#'):
-            title = content_lines[0].lstrip('#').strip()
-        
-        # Create story data
-        story_data = {
-            "title": title or "The Story of Your Soil",
-            "content": story_content,
-            "metadata": {
-                "preferences": story_request.preferences,
-                "analysis_results": analysis_results
-            },
-            "soil_entry_id": entry_id
-        }
-        
-        # Create story in database
-        story_id = await db_service.create_story(user_id, entry_id, story_data)
-        
-        # Get the created story
-        story = await db_service.get_story(story_id)
-        
-        # Update soil entry with story ID
-        story_ids = entry.get("story_ids", [])
-        if not story_ids:
-            story_ids = []
-        story_ids.append(story_id)
-        await db_service.update_soil_entry(entry_id, {"story_ids": story_ids}, user_id)
+    entry_id = story_request.soil_entry_id
+    analysis_results = await _get_analysis_results(entry_id, user_id)
+    
+    # Generate story
+    story_content = await ai_service.generate_story(analysis_results, story_request.preferences)
+    
+    # Save the story and link it to the soil entry after the response is sent
+    story_data = _story_data(story_content, story_request, analysis_results)
+    stored, story = db_service.new_story(user_id, entry_id, story_data)
+    background_tasks.add_task(_save_story, story["id"], entry_id, stored, user_id)
+    
+    return StoryResponse(**story)
+
+@router.post("/stories/stream")
+async def stream_story(
+    background_tasks: BackgroundTasks,
+    story_request: StoryGenerationRequest = Body(...),
+    user_id: str = Depends(get_current_user_id)
+):
+    """Generate a story and stream it as Server-Sent Events
+    
+    Each ``data:`` event carries ``{"delta": text}`` as the model writes. Once
+    generation finishes a final ``event: done`` carries the story, shaped
+    like StoryResponse; it is saved once the stream closes. If the provider
+    fails mid-story an ``event: error`` frame ends the stream instead and
+    nothing is saved.
+    
+    Args:
+        story_request: Story generation request parameters
+        user_id: The authenticated user's ID
         
-        return StoryResponse(**story)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to generate story: {str(e)}"
-        )
+    Returns:
+        A text/event-stream response
+    """
+    entry_id = story_request.soil_entry_id
+    analysis_results = await _get_analysis_results(entry_id, user_id)
+    
+    async def events():
+        parts = []
+        try:
+            async for delta in ai_service.stream_story(analysis_results, story_request.preferences):
+                parts.append(delta)
+                yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+        except Exception:
+            # ai_service has logged it; tell the client the story is incomplete
+            error = orjson.dumps({"error": "Story generation failed"}).decode()
+            yield f"event: error\ndata: {error}\n\n"
+            return
+        
+        story_data = _story_data("".join(parts), story_request, analysis_results)
+        stored, story = db_service.new_story(user_id, entry_id, story_data)
+        background_tasks.add_task(_save_story, story["id"], entry_id, stored, user_id)
+        
+        payload = StoryResponse(**story).model_dump_json()
+        yield f"event: done\ndata: {payload}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-@router.get("/stories", response_model=List[StoryResponse])
+@router.get("/stories", response_model=None, responses={200: {"model": List[StoryResponse]}})
+@cached_response("story")
 async def get_my_stories(
     limit: int = Query(50, ge=1, le=100),
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Get all stories for the current user
     
     Args:
         limit: Maximum number of stories to return
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         List of stories
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Get stories from database
-        stories = await db_service.get_user_stories(user_id, limit)
-        
-        return [StoryResponse(**story) for story in stories]
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get stories: {str(e)}"
-        )
+    # Get stories from database
+    stories = await db_service.get_user_stories(user_id, limit)
+    
+    return project_fields(StoryResponse, stories)
 
-@router.get("/soil-photos/{entry_id}/stories", response_model=List[StoryResponse])
+@router.get("/soil-photos/{entry_id}/stories", response_model=None, responses={200: {"model": List[StoryResponse]}})
+@cached_response("story")
 async def get_stories_for_soil_entry(
     entry_id: str,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Get all stories for a soil entry
     
     Args:
         entry_id: The ID of the soil entry
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         List of stories
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Get stories from database
-        stories = await db_service.get_stories_for_entry(entry_id, user_id)
-        
-        return [StoryResponse(**story) for story in stories]
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get stories: {str(e)}"
-        )
+    # Get stories from database
+    stories = await db_service.get_stories_for_entry(entry_id, user_id)
+    
+    return project_fields(StoryResponse, stories)
 
 @router.get("/stories/{story_id}", response_model=StoryResponse)
+@cached_response("story")
 async def get_story(
     story_id: str,
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Get a story by ID
     
     Args:
         story_id: The ID of the story to get
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         The story
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Get story from database
-        story = await db_service.get_story(story_id, user_id)
-        
-        return StoryResponse(**story)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get story: {str(e)}"
-        )
+    # Get story from database
+    story = await db_service.get_story(story_id, user_id)
+    
+    return StoryResponse(**story)
 
 @router.put("/stories/{story_id}", response_model=StoryResponse)
 async def update_story(
     story_id: str,
     story_data: StoryUpdate = Body(...),
-    current_user: Dict[str, Any] = Depends(get_current_user)
+    user_id: str = Depends(get_current_user_id)
 ):
     """Update a story
     
     Args:
         story_id: The ID of the story to update
         story_data: Updated story data
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         The updated story
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Get existing story to check authorization
-        existing_story = await db_service.get_story(story_id, user_id)
-        
-        # Update story in database
-        story_dict = story_data.model_dump(exclude_unset=True)
-        
-        # Note: We don't allow updating the content field
-        if "content" in story_dict:
-            del story_dict["content"]
-        
-        # Update the document
-        await db_service.update_document("stories", story_id, story_dict)
-        
-        # Get the updated story
-        updated_story = await db_service.get_story(story_id)
-        
-        return StoryResponse(**updated_story)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to update story: {str(e)}"
-        )
\ No newline at end of file
+    # Get existing story to check authorization
+    existing_story = await db_service.get_story(story_id, user_id)
+    
+    # Update story in database
+    story_dict = story_data.model_dump(exclude_unset=True)
+    
+    # Note: We don't allow updating the content field
+    if "content" in story_dict:
+        del story_dict["content"]
+    
+    # Update the document and merge the changes into the story we already have
+    updated_story = await db_service.update_story(story_id, story_dict, existing_story)
+    await invalidate([f"story:{user_id}:"])
+    
+    return StoryResponse(**updated_story)
@@ -1,75 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, Body
 from typing import Dict, Any
 
-from app.core.auth import get_current_user
+from app.core.auth import get_current_user, get_current_user_id
+from app.core.cache import cached_response, invalidate
 from app.schemas.user import UserUpdate, UserResponse
 from app.services.db_service import db_service
 
 router = APIRouter()
 
 @router.get("/users/me", response_model=UserResponse)
-async def get_my_profile(current_user: Dict[str, Any] = Depends(get_current_user)):
+@cached_response("user")
+async def get_my_profile(user_id: str = Depends(get_current_user_id)):
     """Get the current user's profile
     
     Args:
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         The user's profile
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Get user profile from database
-        user_profile = await db_service.get_user_profile(user_id)
-        
-        return UserResponse(**user_profile)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get user profile: {str(e)}"
-        )
+    # Get user profile from database
+    user_profile = await db_service.get_user_profile(user_id)
+    
+    return UserResponse(**user_profile)
 
 @router.put("/users/me", response_model=UserResponse)
-async def update_my_profile(user_data: UserUpdate = Body(...), current_user: Dict[str, Any] = Depends(get_current_user)):
+async def update_my_profile(user_data: UserUpdate = Body(...), user_id: str = Depends(get_current_user_id)):
     """Update the current user's profile
     
     Args:
         user_data: Updated user profile data
-        current_user: The authenticated user from the token
+        user_id: The authenticated user's ID
         
     Returns:
         The updated user profile
     """
-    try:
-        user_id = current_user.get("uid")
-        if not user_id:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid user ID in token"
-            )
-        
-        # Update user profile in database
-        user_dict = user_data.model_dump(exclude_unset=True)
-        updated_profile = await db_service.update_user_profile(user_id, user_dict)
-        
-        return UserResponse(**updated_profile)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to update user profile: {str(e)}"
-        )
+    # Update user profile in database
+    user_dict = user_data.model_dump(exclude_unset=True)
+    updated_profile = await db_service.update_user_profile(user_id, user_dict)
+    await invalidate([f"user:{user_id}:"])
+    
+    return UserResponse(**updated_profile)
 
 @router.get("/users/{user_id}", response_model=UserResponse)
+@cached_response("user")
 async def get_user_profile(user_id: str, current_user: Dict[str, Any] = Depends(get_current_user)):
     """Get a user's profile by ID
     
@@ -80,20 +54,12 @@ async def get_user_profile(user_id: str, current_user: Dict[str, Any] = Depends(
     Returns:
         The user's profile
     """
-    try:
-        # Get user profile from database
-        user_profile = await db_service.get_user_profile(user_id)
-        
-        # Remove sensitive information if not the user themselves
-        if current_user.get("uid") != user_id:
-            # Filter out any sensitive fields if needed
-            pass
-        
-        return UserResponse(**user_profile)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to get user profile: {str(e)}"
-        )
\ No newline at end of file
+    # Get user profile from database
+    user_profile = await db_service.get_user_profile(user_id)
+    
+    # Remove sensitive information if not the user themselves
+    if current_user.get("uid") != user_id:
+        # Filter out any sensitive fields if needed
+        pass
+    
+    return UserResponse(**user_profile)
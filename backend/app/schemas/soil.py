@@ -46,7 +46,7 @@ class SoilPhotoResponse(SoilPhotoBase):
     """Schema for soil photo entry response"""
     id: str
     user_id: str
-    image_url: HttpUrl
+    image_url: str  # Written by our upload path; skip URL parsing on output
     created_at: datetime
     updated_at: datetime
     analysis_results: Optional[SoilAnalysisResult] = None
@@ -1,10 +1,146 @@
+import asyncio
+import base64
 import os
-import requests
-import json
-from typing import Dict, Any, Optional, List
-from fastapi import HTTPException
+import time
+import httpx
+import logging
+import orjson
+from string import Template
+from types import MappingProxyType
+from aiolimiter import AsyncLimiter
+from typing import AsyncIterator, Dict, Any, Optional, List, Tuple
 from app.core.config import settings
-from tenacity import retry, stop_after_attempt, wait_exponential
+from app.services.llm_cache import llm_cache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_URL = "https://api.openai.com/v1"
+OPENAI_CHAT_URL = f"{OPENAI_API_URL}/chat/completions"
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+GEMINI_TEXT_MODEL = "gemini-1.5-flash"
+GEMINI_VISION_MODEL = "gemini-1.5-flash"
+
+ANALYSIS_PROMPT = (
+    "Analyze this soil image and provide detailed soil health metrics including pH, nutrient levels, "
+    "organic matter content, and any visible issues. Also suggest plants that would grow well in this soil. "
+    "Respond with only a JSON object with these keys: soil_type (string), ph_level (number), "
+    "nutrients (object mapping nitrogen, phosphorus, potassium, calcium and magnesium to Low, Medium or High), "
+    "organic_matter (percentage string), moisture (percentage string), health_score (number from 0 to 100), "
+    "recommendations (list of strings), suitable_plants (list of strings), "
+    "analysis_confidence (percentage string)."
+)
+BATCH_ANALYSIS_PROMPT = (
+    "You are given {count} soil images, in order. Analyze each one as described below and respond with only "
+    "a JSON object of the form {{\"results\": [...]}} holding one analysis object per image, in the same order.\n\n"
+)
+ANALYSIS_FIELDS = frozenset({
+    "soil_type", "ph_level", "nutrients", "organic_matter", "moisture",
+    "health_score", "recommendations", "suitable_plants", "analysis_confidence",
+})
+
+# Consecutive provider failures that open the circuit, and how long it stays
+# open (serving simulated results) before calls are tried again
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+
+# OpenAI analyses requested within this window are sent as one multi-image
+# request, up to ANALYSIS_BATCH_SIZE at a time
+ANALYSIS_BATCH_WINDOW = 0.02
+ANALYSIS_BATCH_SIZE = 8
+
+# Leaky buckets shaping outbound calls to each provider's per-minute quotas,
+# so bursts queue here instead of coming back as 429s
+_LIMITS = {
+    "openai": (AsyncLimiter(settings.OPENAI_RPM, 60), AsyncLimiter(settings.OPENAI_TPM, 60)),
+    "gemini": (AsyncLimiter(settings.GEMINI_RPM, 60), AsyncLimiter(settings.GEMINI_TPM, 60)),
+}
+
+def story_title(story_content: str) -> str:
+    """Title for a generated story: its leading markdown heading, if any"""
+    first_line = story_content.split('\n', 1)[0]
+    if first_line.startswith('#'):
+        return first_line.lstrip('#').strip() or "The Story of Your Soil"
+    return "The Story of Your Soil"
+
+def _json_body(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Swap an httpx ``json=`` argument for an orjson-encoded body"""
+    if "json" in kwargs:
+        kwargs["content"] = orjson.dumps(kwargs.pop("json"))
+        kwargs["headers"] = {**(kwargs.get("headers") or {}), "Content-Type": "application/json"}
+    return kwargs
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Retry network errors, rate limits and server errors, not other 4xx"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+STORY_SYSTEM_PROMPT = "You are a creative writer specializing in environmental storytelling that educates and inspires gardeners."
+_STORY_SYSTEM_MESSAGE = {"role": "system", "content": STORY_SYSTEM_PROMPT}
+_GEMINI_STORY_SYSTEM = {"parts": [{"text": STORY_SYSTEM_PROMPT}]}
+
+# Nutrients are listed in sorted order so equal analyses give equal prompts
+# (and share LLM cache entries)
+_STORY_PROMPT = Template("""Create an engaging and personalized story about a garden's soil. Here are the details:
+            
+            Soil Type: $soil_type
+            Health Score: $health_score/100
+            Key Nutrients: $nutrients
+            Plants that would thrive: $plants
+            
+            The story should be $tone in tone and written for a $audience. 
+            Personify the soil and its microorganisms as characters in the story.
+            Include practical gardening advice based on the soil analysis.
+            Keep the story under 500 words.
+            """)
+
+# Fixed parts of the simulated results used when no provider is available
+_SIM_ANALYSIS = MappingProxyType({
+    "soil_type": "Loamy",
+    "nutrients": {
+        "nitrogen": "Medium",
+        "phosphorus": "High",
+        "potassium": "Medium",
+        "calcium": "Medium",
+        "magnesium": "Low"
+    },
+    "recommendations": [
+        "Add compost to increase organic matter",
+        "Consider adding magnesium supplements",
+        "Maintain current watering schedule"
+    ],
+    "suitable_plants": [
+        "Tomatoes",
+        "Peppers",
+        "Zucchini",
+        "Marigolds",
+        "Sunflowers"
+    ],
+    "analysis_confidence": "85%"
+})
+
+_SIM_STORY = Template("""# The Secret Life of Your Garden Soil
+
+Beneath your garden lies a $mood world of $soil_type soil, home to billions of tiny organisms working in harmony. Your soil is currently $quality, with a health score of $health_score/100.
+
+Meet Terra, the soil particle who has lived in your garden for decades. Terra remembers when this land was wild and untamed, but has grown to appreciate the care you've shown as a gardener. Terra works with her friends - the nitrogen-fixing bacteria, the industrious earthworms, and the decomposing fungi - to create a welcoming home for plant roots.
+
+"We've created quite a community here," Terra tells the newly arrived compost particles. "Our pH levels are balanced, and we've got a good mix of nutrients flowing through our networks."
+
+The earthworm named Wiggle tunnels by, creating channels for water and air. "The humans above have been watering consistently," Wiggle reports. "And that last application of compost really brought in some wonderful new neighbors!"
+
+Your soil community would especially welcome plants like $suitable_plants. These plants would thrive in the current conditions, their roots forming beneficial relationships with the mycorrhizal fungi network that helps distribute resources throughout the soil ecosystem.
+
+To keep your soil community happy, consider these tips from Terra and friends:
+
+1. Add a thin layer of compost every season to introduce new beneficial organisms
+2. Avoid over-tilling, which disrupts the delicate networks formed underground
+3. Mulch during hot periods to maintain moisture and protect soil life
+4. Plant a diverse range of species to encourage different types of soil interactions
+
+Remember, healthy soil means healthy plants, and your garden's soil has stories to tell if you listen closely enough!
+""")
 
 class AIService:
     """Service for interacting with AI providers for soil analysis and story generation"""
@@ -16,17 +152,77 @@ class AIService:
         if self.provider == "openai":
             self.api_key = settings.OPENAI_API_KEY
             if not self.api_key:
-                print("Warning: OpenAI API key not set")
+                logger.warning("OpenAI API key not set")
         elif self.provider == "gemini":
             self.api_key = settings.GEMINI_API_KEY
             if not self.api_key:
-                print("Warning: Gemini API key not set")
+                logger.warning("Gemini API key not set")
         else:
-            print(f"Warning: Unknown AI provider {self.provider}, defaulting to OpenAI")
+            logger.warning("Unknown AI provider %s, defaulting to OpenAI", self.provider)
             self.provider = "openai"
             self.api_key = settings.OPENAI_API_KEY
+        
+        # One pooled HTTP/2 client for every provider call, so concurrent
+        # completions multiplex over a few TLS connections; closed on shutdown
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30.0),
+        )
+    
+        # Micro-batching of OpenAI analyses; the queue and worker are created
+        # on first use, inside the running event loop
+        self._batch_queue: Optional[asyncio.Queue] = None
+        self._batch_worker: Optional[asyncio.Task] = None
+        self._batch_tasks: set = set()
+        
+        # Circuit breaker state per provider
+        self._breaker = {"openai": {"fails": 0, "open_until": 0.0}, "gemini": {"fails": 0, "open_until": 0.0}}
+    
+    async def aclose(self) -> None:
+        """Stop the analysis batcher and close the shared HTTP client"""
+        if self._batch_worker is not None:
+            self._batch_worker.cancel()
+            self._batch_worker = None
+        await self._client.aclose()
+    
+    def _circuit_open(self) -> bool:
+        """Whether recent failures mean the provider should be skipped for now"""
+        return time.monotonic() < self._breaker[self.provider]["open_until"]
+    
+    def _record_outcome(self, ok: bool) -> None:
+        """Track consecutive failures and open the circuit after too many"""
+        state = self._breaker[self.provider]
+        if ok:
+            state["fails"] = 0
+            return
+        state["fails"] += 1
+        if state["fails"] >= BREAKER_THRESHOLD:
+            state["open_until"] = time.monotonic() + BREAKER_COOLDOWN
+            state["fails"] = 0
+    
+    async def _throttle(self, prompt: str, max_tokens: int) -> None:
+        """Wait for request and token budget before calling the provider
+        
+        Tokens are estimated as ~4 characters per prompt token plus the
+        completion limit.
+        """
+        rpm, tpm = _LIMITS[self.provider]
+        await rpm.acquire()
+        await tpm.acquire(min(len(prompt) // 4 + max_tokens, tpm.max_rate))
+    
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_random_exponential(multiplier=1, max=10),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True,
+    )
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a provider request, retrying transient failures with jittered backoff"""
+        response = await self._client.request(method, url, **_json_body(kwargs))
+        response.raise_for_status()
+        return response
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     async def analyze_soil_image(self, image_url: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze soil image and return soil health metrics
         
@@ -37,23 +233,38 @@ class AIService:
         Returns:
             Dict containing soil analysis results
         """
+        if self.provider not in ("openai", "gemini") or not self.api_key or self._circuit_open():
+            return self._simulate_soil_analysis(metadata)
+        
+        # The same photo with the same preferences gets the same analysis
+        cache_key = llm_cache.key("analysis", self.provider, {
+            "image_url": image_url,
+            "preferences": metadata.get("analysis_preferences"),
+        })
+        cached = await llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        # Batched OpenAI analyses record one breaker outcome per request in
+        # _send_analysis_batch, not one per caller
+        batched = self.provider == "openai"
         try:
-            # For now, we'll simulate the analysis with basic metrics
-            # In a real implementation, this would call the AI service with the image
-            
-            if self.provider == "openai":
-                return await self._analyze_with_openai(image_url, metadata)
-            elif self.provider == "gemini":
-                return await self._analyze_with_gemini(image_url, metadata)
+            if batched:
+                analysis = await self._analyze_with_openai(image_url, metadata)
             else:
-                # Fallback to simulated results
-                return self._simulate_soil_analysis(metadata)
-                
-        except Exception as e:
-            print(f"Error in soil analysis: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+                analysis = await self._analyze_with_gemini(image_url, metadata)
+        except Exception:
+            # Fall back to simulated results; these are never cached
+            logger.exception("Soil analysis failed")
+            if not batched:
+                self._record_outcome(False)
+            return self._simulate_soil_analysis(metadata)
+        
+        if not batched:
+            self._record_outcome(True)
+        await llm_cache.set(cache_key, analysis)
+        return analysis
     
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
     async def generate_story(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> str:
         """Generate a personalized story based on soil analysis results
         
@@ -64,182 +275,389 @@ class AIService:
         Returns:
             Generated story text
         """
+        if self.provider not in ("openai", "gemini") or not self.api_key or self._circuit_open():
+            return self._simulate_story_generation(analysis_results, user_preferences)
+        
+        # Stories are sampled at temperature 0.7, so only the default request
+        # (no preferences) is treated as repeatable and cached
+        cache_key = None
+        if user_preferences is None:
+            cache_key = llm_cache.key("story", self.provider, analysis_results)
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
         try:
             if self.provider == "openai":
-                return await self._generate_story_with_openai(analysis_results, user_preferences)
-            elif self.provider == "gemini":
-                return await self._generate_story_with_gemini(analysis_results, user_preferences)
+                story = await self._generate_story_with_openai(analysis_results, user_preferences)
             else:
-                # Fallback to simulated results
-                return self._simulate_story_generation(analysis_results, user_preferences)
-                
-        except Exception as e:
-            print(f"Error in story generation: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+                story = await self._generate_story_with_gemini(analysis_results, user_preferences)
+        except Exception:
+            # Fall back to simulated results; these are never cached
+            logger.exception("Story generation failed")
+            self._record_outcome(False)
+            return self._simulate_story_generation(analysis_results, user_preferences)
+        
+        self._record_outcome(True)
+        if cache_key:
+            await llm_cache.set(cache_key, story)
+        return story
+    
+    async def stream_story(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Generate a story, yielding text as the provider produces it
+        
+        Only OpenAI streams. Other providers, cache hits and simulated
+        fallbacks yield the whole story at once.
+        
+        Args:
+            analysis_results: Results from soil analysis
+            user_preferences: Optional user preferences for story generation
+            
+        Yields:
+            Consecutive pieces of the story text
+        """
+        if self.provider != "openai" or not self.api_key or self._circuit_open():
+            yield await self.generate_story(analysis_results, user_preferences)
+            return
+        
+        cache_key = None
+        if user_preferences is None:
+            cache_key = llm_cache.key("story", self.provider, analysis_results)
+            cached = await llm_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        parts = []
+        try:
+            async for delta in self._stream_story_with_openai(analysis_results, user_preferences):
+                parts.append(delta)
+                yield delta
+        except Exception:
+            logger.exception("Story generation failed")
+            self._record_outcome(False)
+            # Text already sent can't be replaced by a fallback
+            if parts:
+                raise
+            yield self._simulate_story_generation(analysis_results, user_preferences)
+            return
+        
+        self._record_outcome(True)
+        if cache_key:
+            await llm_cache.set(cache_key, "".join(parts))
     
     async def _analyze_with_openai(self, image_url: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
-        """Analyze soil image using OpenAI's API"""
-        if not self.api_key:
-            return self._simulate_soil_analysis(metadata)
+        """Analyze soil image using OpenAI's API
         
+        Calls are queued and grouped by _run_analysis_batches, so concurrent
+        uploads share one request (and one prompt) instead of one each.
+        """
+        if self._batch_worker is None or self._batch_worker.done():
+            self._batch_queue = asyncio.Queue()
+            self._batch_worker = asyncio.create_task(self._run_analysis_batches())
+        future = asyncio.get_running_loop().create_future()
+        await self._batch_queue.put((image_url, future))
+        return await future
+    
+    async def _run_analysis_batches(self) -> None:
+        """Drain queued analyses into batches and send each batch concurrently"""
+        while True:
+            batch = [await self._batch_queue.get()]
+            await asyncio.sleep(ANALYSIS_BATCH_WINDOW)
+            while len(batch) < ANALYSIS_BATCH_SIZE and not self._batch_queue.empty():
+                batch.append(self._batch_queue.get_nowait())
+            task = asyncio.create_task(self._send_analysis_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+    
+    def _analysis_payload(self, prompt: str, image_urls: List[str]) -> Dict[str, Any]:
+        """OpenAI chat payload analyzing one or more soil images"""
+        return {
+            "model": settings.OPENAI_ANALYSIS_MODEL,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"type": "text", "text": prompt}] + [
+                        {"type": "image_url", "image_url": {"url": image_url}}
+                        for image_url in image_urls
+                    ]
+                }
+            ],
+            "max_tokens": 500 * len(image_urls)
+        }
+    
+    async def _send_analysis_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """Analyze a batch of images in one OpenAI request and resolve each caller"""
         try:
-            # This is a simplified example - in production, you would:
-            # 1. Download the image or use a direct URL if OpenAI supports it
-            # 2. Use OpenAI's vision capabilities to analyze the image
-            # 3. Process the response to extract soil metrics
+            if len(batch) == 1:
+                prompt = ANALYSIS_PROMPT
+            else:
+                prompt = BATCH_ANALYSIS_PROMPT.format(count=len(batch)) + ANALYSIS_PROMPT
             
-            # Example using GPT-4 Vision API (simplified)
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
                 "Content-Type": "application/json"
             }
+            payload = self._analysis_payload(prompt, [image_url for image_url, _ in batch])
             
-            payload = {
-                "model": "gpt-4-vision-preview",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": "Analyze this soil image and provide detailed soil health metrics including pH, nutrient levels, organic matter content, and any visible issues. Also suggest plants that would grow well in this soil."},
-                            {"type": "image_url", "image_url": {"url": image_url}}
-                        ]
-                    }
-                ],
-                "max_tokens": 500
-            }
+            await self._throttle(prompt, payload["max_tokens"])
+            response = await self._request("POST", OPENAI_CHAT_URL, headers=headers, json=payload)
+            content = orjson.loads(response.content)["choices"][0]["message"]["content"]
+            if len(batch) == 1:
+                results = [self._parse_analysis(content)]
+            else:
+                results = self._parse_analysis_batch(content, len(batch))
+        except Exception as e:
+            self._record_outcome(False)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        self._record_outcome(True)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    @property
+    def batch_enabled(self) -> bool:
+        """Whether deferred analyses can go through the OpenAI Batch API"""
+        return self.provider == "openai" and bool(self.api_key)
+    
+    async def submit_batch(self, requests: List[Tuple[str, str]]) -> str:
+        """Submit soil analyses to the OpenAI Batch API
+        
+        Batch requests are billed at half price from a separate rate-limit
+        pool, but complete within 24 hours rather than immediately.
+        
+        Args:
+            requests: (custom_id, image_url) pairs; custom_id comes back with each result
             
-            # In a real implementation, you would make the API call
-            # response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            # response_data = response.json()
+        Returns:
+            The OpenAI batch ID
+        """
+        lines = [
+            orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": self._analysis_payload(ANALYSIS_PROMPT, [image_url]),
+            })
+            for custom_id, image_url in requests
+        ]
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        upload = await self._request(
+            "POST", f"{OPENAI_API_URL}/files", headers=headers,
+            data={"purpose": "batch"},
+            files={"file": ("analyses.jsonl", b"\n".join(lines), "application/jsonl")},
+        )
+        batch = await self._request(
+            "POST", f"{OPENAI_API_URL}/batches", headers=headers,
+            json={
+                "input_file_id": orjson.loads(upload.content)["id"],
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h",
+            },
+        )
+        return orjson.loads(batch.content)["id"]
+    
+    async def get_batch_results(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Fetch the analyses of a finished OpenAI batch
+        
+        Args:
+            batch_id: ID returned by submit_batch
             
-            # For now, return simulated results
-            return self._simulate_soil_analysis(metadata)
+        Returns:
+            None while the batch is still running, otherwise analyses keyed by
+            custom_id (requests whose reply couldn't be parsed are left out)
             
-        except Exception as e:
-            print(f"OpenAI analysis error: {str(e)}")
-            return self._simulate_soil_analysis(metadata)
+        Raises:
+            RuntimeError: If the batch failed, expired or was cancelled
+        """
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        batch = orjson.loads((await self._request("GET", f"{OPENAI_API_URL}/batches/{batch_id}", headers=headers)).content)
+        if batch["status"] in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} {batch['status']}")
+        if batch["status"] != "completed":
+            return None
+        
+        results = {}
+        if not batch.get("output_file_id"):
+            return results
+        output = await self._request("GET", f"{OPENAI_API_URL}/files/{batch['output_file_id']}/content", headers=headers)
+        for line in output.content.splitlines():
+            if not line:
+                continue
+            item = orjson.loads(line)
+            try:
+                content = item["response"]["body"]["choices"][0]["message"]["content"]
+                results[item["custom_id"]] = self._parse_analysis(content)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.warning("Skipping unusable batch result %s: %s", item.get("custom_id"), e)
+        return results
     
     async def _analyze_with_gemini(self, image_url: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze soil image using Google's Gemini API"""
-        if not self.api_key:
-            return self._simulate_soil_analysis(metadata)
+        # Gemini takes images inline rather than by URL
+        image = await self._request("GET", image_url)
         
-        try:
-            # This is a simplified example - in production, you would:
-            # 1. Download the image or use a direct URL if Gemini supports it
-            # 2. Use Gemini's vision capabilities to analyze the image
-            # 3. Process the response to extract soil metrics
-            
-            # For now, return simulated results
-            return self._simulate_soil_analysis(metadata)
-            
-        except Exception as e:
-            print(f"Gemini analysis error: {str(e)}")
-            return self._simulate_soil_analysis(metadata)
+        payload = {
+            "contents": [{
+                "parts": [
+                    {"text": ANALYSIS_PROMPT},
+                    {"inline_data": {
+                        "mime_type": image.headers.get("content-type", "image/jpeg"),
+                        "data": base64.b64encode(image.content).decode("ascii"),
+                    }},
+                ]
+            }],
+            "generationConfig": {"maxOutputTokens": 500},
+        }
+        
+        await self._throttle(ANALYSIS_PROMPT, payload["generationConfig"]["maxOutputTokens"])
+        content = await self._post_gemini(GEMINI_VISION_MODEL, payload)
+        return self._parse_analysis(content)
+    
+    async def _post_gemini(self, model: str, payload: Dict[str, Any]) -> str:
+        """Call Gemini generateContent and return the first candidate's text"""
+        response = await self._request(
+            "POST",
+            f"{GEMINI_API_URL}/{model}:generateContent",
+            params={"key": self.api_key},
+            json=payload,
+        )
+        parts = orjson.loads(response.content)["candidates"][0]["content"]["parts"]
+        return "".join(part.get("text", "") for part in parts)
+    
+    def _parse_analysis(self, content: str) -> Dict[str, Any]:
+        """Parse a model's JSON analysis
+        
+        Raises:
+            ValueError: If the reply isn't a JSON object with every result field
+        """
+        text = content.strip()
+        # Models often wrap JSON in a markdown code fence
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("{"):]
+        analysis = orjson.loads(text)
+        if not isinstance(analysis, dict) or not ANALYSIS_FIELDS.issubset(analysis):
+            raise ValueError("AI analysis is missing result fields")
+        return analysis
+    
+    def _parse_analysis_batch(self, content: str, count: int) -> List[Dict[str, Any]]:
+        """Parse a batched reply of the form {"results": [analysis, ...]}
+        
+        Raises:
+            ValueError: If the reply doesn't hold exactly one valid analysis per image
+        """
+        text = content.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[text.find("{"):]
+        results = orjson.loads(text).get("results")
+        if not isinstance(results, list) or len(results) != count:
+            raise ValueError("AI batch analysis returned the wrong number of results")
+        for analysis in results:
+            if not isinstance(analysis, dict) or not ANALYSIS_FIELDS.issubset(analysis):
+                raise ValueError("AI analysis is missing result fields")
+        return results
     
     def _simulate_soil_analysis(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
         """Simulate soil analysis results for development and testing"""
-        # Generate realistic-looking soil analysis results
+        # Only the numbers vary with the seed
+        seed = metadata.get("random_seed", 0)
         return {
-            "soil_type": "Loamy",
-            "ph_level": round(6.0 + (metadata.get("random_seed", 0) % 20) / 10, 1),  # pH between 6.0 and 8.0
-            "nutrients": {
-                "nitrogen": "Medium",
-                "phosphorus": "High",
-                "potassium": "Medium",
-                "calcium": "Medium",
-                "magnesium": "Low"
-            },
-            "organic_matter": f"{3 + (metadata.get('random_seed', 0) % 7)}%",  # Between 3% and 10%
-            "moisture": f"{20 + (metadata.get('random_seed', 0) % 40)}%",  # Between 20% and 60%
-            "health_score": round(60 + (metadata.get("random_seed", 0) % 40), 1),  # Between 60 and 100
-            "recommendations": [
-                "Add compost to increase organic matter",
-                "Consider adding magnesium supplements",
-                "Maintain current watering schedule"
-            ],
-            "suitable_plants": [
-                "Tomatoes",
-                "Peppers",
-                "Zucchini",
-                "Marigolds",
-                "Sunflowers"
+            **_SIM_ANALYSIS,
+            "ph_level": round(6.0 + (seed % 20) / 10, 1),  # pH between 6.0 and 8.0
+            "organic_matter": f"{3 + (seed % 7)}%",  # Between 3% and 10%
+            "moisture": f"{20 + (seed % 40)}%",  # Between 20% and 60%
+            "health_score": round(60 + (seed % 40), 1),  # Between 60 and 100
+        }
+    
+    def _build_story_prompt(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> str:
+        """Build the story prompt from analysis results and user preferences"""
+        soil_type = analysis_results.get("soil_type", "unknown")
+        health_score = analysis_results.get("health_score", 50)
+        nutrients = analysis_results.get("nutrients", {})
+        suitable_plants = analysis_results.get("suitable_plants", [])
+        
+        # Consider user preferences if available
+        tone = "informative"
+        audience = "gardener"
+        if user_preferences:
+            tone = user_preferences.get("tone", tone)
+            audience = user_preferences.get("audience", audience)
+        
+        return _STORY_PROMPT.substitute(
+            soil_type=soil_type,
+            health_score=health_score,
+            nutrients=", ".join(f"{k}: {v}" for k, v in sorted(nutrients.items())),
+            plants=", ".join(suitable_plants),
+            tone=tone,
+            audience=audience,
+        )
+    
+    def _story_payload(self, prompt: str) -> Dict[str, Any]:
+        """OpenAI chat payload for a story prompt"""
+        return {
+            "model": settings.OPENAI_STORY_MODEL,
+            "messages": [
+                _STORY_SYSTEM_MESSAGE,
+                {"role": "user", "content": prompt}
             ],
-            "analysis_confidence": "85%"
+            "temperature": 0.7,
+            "max_tokens": 800
         }
     
     async def _generate_story_with_openai(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> str:
         """Generate story using OpenAI's API"""
-        if not self.api_key:
-            return self._simulate_story_generation(analysis_results, user_preferences)
+        prompt = self._build_story_prompt(analysis_results, user_preferences)
         
-        try:
-            # Prepare the prompt based on analysis results and user preferences
-            soil_type = analysis_results.get("soil_type", "unknown")
-            health_score = analysis_results.get("health_score", 50)
-            nutrients = analysis_results.get("nutrients", {})
-            suitable_plants = analysis_results.get("suitable_plants", [])
-            
-            # Consider user preferences if available
-            tone = "informative"
-            audience = "gardener"
-            if user_preferences:
-                tone = user_preferences.get("tone", tone)
-                audience = user_preferences.get("audience", audience)
-            
-            prompt = f"""Create an engaging and personalized story about a garden's soil. Here are the details:
-            
-            Soil Type: {soil_type}
-            Health Score: {health_score}/100
-            Key Nutrients: {', '.join([f'{k}: {v}' for k, v in nutrients.items()])}
-            Plants that would thrive: {', '.join(suitable_plants)}
-            
-            The story should be {tone} in tone and written for a {audience}. 
-            Personify the soil and its microorganisms as characters in the story.
-            Include practical gardening advice based on the soil analysis.
-            Keep the story under 500 words.
-            """
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "model": "gpt-4",
-                "messages": [
-                    {"role": "system", "content": "You are a creative writer specializing in environmental storytelling that educates and inspires gardeners."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 800
-            }
-            
-            # In a real implementation, you would make the API call
-            # response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
-            # response_data = response.json()
-            # story = response_data['choices'][0]['message']['content']
-            
-            # For now, return simulated results
-            return self._simulate_story_generation(analysis_results, user_preferences)
-            
-        except Exception as e:
-            print(f"OpenAI story generation error: {str(e)}")
-            return self._simulate_story_generation(analysis_results, user_preferences)
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = self._story_payload(prompt)
+        
+        await self._throttle(prompt, payload["max_tokens"])
+        response = await self._request("POST", OPENAI_CHAT_URL, headers=headers, json=payload)
+        return orjson.loads(response.content)["choices"][0]["message"]["content"]
+    
+    async def _stream_story_with_openai(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Stream a story from OpenAI's API as server-sent deltas"""
+        prompt = self._build_story_prompt(analysis_results, user_preferences)
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {**self._story_payload(prompt), "stream": True}
+        
+        await self._throttle(prompt, payload["max_tokens"])
+        async with self._client.stream("POST", OPENAI_CHAT_URL, **_json_body({"headers": headers, "json": payload})) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[6:]
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices")
+                delta = choices[0]["delta"].get("content") if choices else None
+                if delta:
+                    yield delta
     
     async def _generate_story_with_gemini(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> str:
         """Generate story using Google's Gemini API"""
-        if not self.api_key:
-            return self._simulate_story_generation(analysis_results, user_preferences)
-        
-        try:
-            # Similar implementation to OpenAI but using Gemini API
-            # For now, return simulated results
-            return self._simulate_story_generation(analysis_results, user_preferences)
-            
-        except Exception as e:
-            print(f"Gemini story generation error: {str(e)}")
-            return self._simulate_story_generation(analysis_results, user_preferences)
+        prompt = self._build_story_prompt(analysis_results, user_preferences)
+        payload = {
+            "systemInstruction": _GEMINI_STORY_SYSTEM,
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": 0.7, "maxOutputTokens": 800},
+        }
+        await self._throttle(prompt, payload["generationConfig"]["maxOutputTokens"])
+        return await self._post_gemini(GEMINI_TEXT_MODEL, payload)
     
     def _simulate_story_generation(self, analysis_results: Dict[str, Any], user_preferences: Optional[Dict[str, Any]] = None) -> str:
         """Simulate story generation for development and testing"""
@@ -258,29 +676,13 @@ class AIService:
             quality = "struggling"
             mood = "tired"
         
-        story = f"""# The Secret Life of Your Garden Soil
-
-Beneath your garden lies a {mood} world of {soil_type} soil, home to billions of tiny organisms working in harmony. Your soil is currently {quality}, with a health score of {health_score}/100.
-
-Meet Terra, the soil particle who has lived in your garden for decades. Terra remembers when this land was wild and untamed, but has grown to appreciate the care you've shown as a gardener. Terra works with her friends - the nitrogen-fixing bacteria, the industrious earthworms, and the decomposing fungi - to create a welcoming home for plant roots.
-
-"We've created quite a community here," Terra tells the newly arrived compost particles. "Our pH levels are balanced, and we've got a good mix of nutrients flowing through our networks."
-
-The earthworm named Wiggle tunnels by, creating channels for water and air. "The humans above have been watering consistently," Wiggle reports. "And that last application of compost really brought in some wonderful new neighbors!"
-
-Your soil community would especially welcome plants like {suitable_plants}. These plants would thrive in the current conditions, their roots forming beneficial relationships with the mycorrhizal fungi network that helps distribute resources throughout the soil ecosystem.
-
-To keep your soil community happy, consider these tips from Terra and friends:
-
-1. Add a thin layer of compost every season to introduce new beneficial organisms
-2. Avoid over-tilling, which disrupts the delicate networks formed underground
-3. Mulch during hot periods to maintain moisture and protect soil life
-4. Plant a diverse range of species to encourage different types of soil interactions
-
-Remember, healthy soil means healthy plants, and your garden's soil has stories to tell if you listen closely enough!
-"""
-        
-        return story
+        return _SIM_STORY.substitute(
+            mood=mood,
+            soil_type=soil_type,
+            quality=quality,
+            health_score=health_score,
+            suitable_plants=suitable_plants,
+        )
 
 # Create a singleton instance
 ai_service = AIService()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from typing import Dict, Any
+
+from app.core.cache import invalidate
+from app.services.ai_service import ai_service, story_title
+from app.services.db_service import db_service
+
+logger = logging.getLogger(__name__)
+
+# How often pending OpenAI batches are checked; results take minutes to hours
+BATCH_POLL_INTERVAL = 300
+
+async def submit_deferred_analysis(entry_id: str, image_url: str, user_id: str) -> None:
+    """Queue a soil entry's analysis on the OpenAI Batch API
+    
+    Args:
+        entry_id: Soil entry ID, used as the batch request's custom_id
+        image_url: Public URL of the soil photo
+        user_id: Owner of the soil entry
+    """
+    try:
+        batch_id = await ai_service.submit_batch([(entry_id, image_url)])
+        await db_service.create_pending_batch(batch_id, [{"entry_id": entry_id, "user_id": user_id}])
+    except Exception:
+        # The entry can still be analyzed on demand
+        logger.exception("Could not submit deferred analysis for %s", entry_id)
+
+async def _store_batch_entry(entry: Dict[str, str], analysis: Dict[str, Any]) -> None:
+    entry_id, user_id = entry["entry_id"], entry["user_id"]
+    # Confirm the entry still exists and belongs to the user before writing
+    await db_service.get_soil_entry(entry_id, user_id)
+    
+    # The analysis, story and link are committed together
+    story_content = await ai_service.generate_story(analysis)
+    await db_service.create_linked_story(user_id, entry_id, {
+        "title": story_title(story_content),
+        "content": story_content,
+        "metadata": {"preferences": None, "analysis_results": analysis},
+        "soil_entry_id": entry_id,
+    }, analysis)
+    await invalidate([f"soil:{user_id}:", f"story:{user_id}:"])
+
+async def poll_pending_batches() -> None:
+    """Store the analyses (and a default story) of every finished batch"""
+    for batch in await db_service.get_pending_batches():
+        batch_id = batch["id"]
+        try:
+            results = await ai_service.get_batch_results(batch_id)
+        except RuntimeError as e:
+            logger.error("Deferred analysis failed: %s", e)
+            await db_service.finish_pending_batch(batch_id, "failed")
+            continue
+        if results is None:
+            continue
+        
+        for entry in batch.get("entries", []):
+            analysis = results.get(entry["entry_id"])
+            if analysis is None:
+                continue
+            try:
+                await _store_batch_entry(entry, analysis)
+            except Exception:
+                logger.exception("Could not store deferred analysis for %s", entry["entry_id"])
+        await db_service.finish_pending_batch(batch_id, "completed")
+
+async def run_batch_poller(interval: float = BATCH_POLL_INTERVAL) -> None:
+    """Poll pending batches forever; started from the application lifespan"""
+    while True:
+        try:
+            await poll_pending_batches()
+        except Exception:
+            logger.exception("Error polling OpenAI batches")
+        await asyncio.sleep(interval)
@@ -1,11 +1,47 @@
-from typing import Dict, Any, List, Optional, Union
-from datetime import datetime
+import asyncio
+from typing import Dict, Any, List, Optional, Tuple, Union
+from datetime import datetime, timezone
+from cachetools import TTLCache
+from firebase_admin import firestore
 from app.core.firebase import (
     get_document, add_document, update_document, 
-    delete_document, query_collection
+    delete_document, query_collection, batch_write, new_document_id
 )
 from fastapi import HTTPException, status
 
+# Fields fetched for list endpoints. Full documents (image_path, upload
+# metadata, the analysis copied into each story) are only read for single
+# items.
+SOIL_LIST_FIELDS = [
+    "user_id", "title", "description", "image_url", "location", "tags",
+    "created_at", "updated_at", "analysis_results", "story_ids",
+]
+STORY_LIST_FIELDS = [
+    "user_id", "soil_entry_id", "title", "content", "metadata.preferences",
+    "created_at", "updated_at",
+]
+
+# Lists are returned newest first; Firestore sorts before applying the limit
+NEWEST_FIRST = ("created_at", "DESCENDING")
+
+# Profiles and soil entries are re-read on nearly every request (ownership
+# checks, story generation) but rarely change. Writes through this service
+# drop the cached copy; other workers may serve it until the TTL runs out.
+_profile_cache: TTLCache = TTLCache(maxsize=10_000, ttl=30)
+_entry_cache: TTLCache = TTLCache(maxsize=50_000, ttl=15)
+
+def _stamped(data: Dict[str, Any], *fields: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Split data into the document to write and the copy to return
+    
+    The written copy has server timestamps for ``fields``, which Firestore
+    fills in at commit. The returned copy uses the local clock, because
+    callers need real values and can't use the sentinel.
+    """
+    now = datetime.now(timezone.utc)
+    stored = {**data, **dict.fromkeys(fields, firestore.SERVER_TIMESTAMP)}
+    returned = {**data, **dict.fromkeys(fields, now)}
+    return stored, returned
+
 class DatabaseService:
     """Service for handling database operations"""
     
@@ -21,12 +57,12 @@ class DatabaseService:
             User ID of the created profile
         """
         try:
-            # Add timestamp
-            user_data["created_at"] = datetime.utcnow().isoformat()
-            user_data["updated_at"] = user_data["created_at"]
+            # Add timestamps
+            stored, _ = _stamped(user_data, "created_at", "updated_at")
             
             # Add the document with the user_id as the document ID
-            add_document("users", user_data, user_id)
+            await add_document("users", stored, user_id)
+            _profile_cache.pop(user_id, None)
             return user_id
         except Exception as e:
             raise HTTPException(
@@ -47,12 +83,15 @@ class DatabaseService:
         Raises:
             HTTPException: If user profile not found
         """
-        user_data = get_document("users", user_id)
-        if not user_data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User profile not found"
-            )
+        user_data = _profile_cache.get(user_id)
+        if user_data is None:
+            user_data = await get_document("users", user_id)
+            if not user_data:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="User profile not found"
+                )
+            _profile_cache[user_id] = user_data
         return user_data
     
     @staticmethod
@@ -71,19 +110,22 @@ class DatabaseService:
         """
         try:
             # Add updated timestamp
-            user_data["updated_at"] = datetime.utcnow().isoformat()
+            stored, user_data = _stamped(user_data, "updated_at")
             
-            # Update the document
-            success = update_document("users", user_id, user_data)
+            # Update the document, reading the stored profile alongside the
+            # write; the new fields are merged over it either way
+            success, existing = await asyncio.gather(
+                update_document("users", user_id, stored),
+                get_document("users", user_id),
+            )
+            _profile_cache.pop(user_id, None)
             if not success:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Failed to update user profile"
                 )
             
-            # Get the updated profile
-            updated_profile = await DatabaseService.get_user_profile(user_id)
-            return updated_profile
+            return {**(existing or {}), **user_data}
         except HTTPException:
             raise
         except Exception as e:
@@ -93,7 +135,7 @@ class DatabaseService:
             )
     
     @staticmethod
-    async def create_soil_entry(user_id: str, soil_data: Dict[str, Any]) -> str:
+    async def create_soil_entry(user_id: str, soil_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new soil entry in the database
         
         Args:
@@ -101,17 +143,15 @@ class DatabaseService:
             soil_data: Soil entry data including image URL, location, etc.
             
         Returns:
-            ID of the created soil entry
+            The created soil entry, including its ID
         """
         try:
             # Add user ID and timestamps
-            soil_data["user_id"] = user_id
-            soil_data["created_at"] = datetime.utcnow().isoformat()
-            soil_data["updated_at"] = soil_data["created_at"]
+            stored, soil_data = _stamped({**soil_data, "user_id": user_id}, "created_at", "updated_at")
             
             # Add the document
-            entry_id = add_document("soil_entries", soil_data)
-            return entry_id
+            entry_id = await add_document("soil_entries", stored)
+            return {"id": entry_id, **soil_data}
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -132,14 +172,18 @@ class DatabaseService:
         Raises:
             HTTPException: If soil entry not found or user not authorized
         """
-        soil_data = get_document("soil_entries", entry_id)
-        if not soil_data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Soil entry not found"
-            )
+        soil_data = _entry_cache.get(entry_id)
+        if soil_data is None:
+            soil_data = await get_document("soil_entries", entry_id)
+            if not soil_data:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Soil entry not found"
+                )
+            _entry_cache[entry_id] = soil_data
         
-        # Check if the user is authorized to access this entry
+        # Check if the user is authorized to access this entry; the owner
+        # never changes, so checking a cached copy is safe
         if user_id and soil_data.get("user_id") != user_id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
@@ -160,12 +204,9 @@ class DatabaseService:
             List of soil entries
         """
         try:
-            entries = query_collection("soil_entries", "user_id", "==", user_id, limit)
-            
-            # Sort by created_at in descending order (newest first)
-            entries.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            
-            return entries
+            return await query_collection(
+                "soil_entries", "user_id", "==", user_id, limit, SOIL_LIST_FIELDS, order_by=NEWEST_FIRST
+            )
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -173,13 +214,16 @@ class DatabaseService:
             )
     
     @staticmethod
-    async def update_soil_entry(entry_id: str, soil_data: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    async def update_soil_entry(entry_id: str, soil_data: Dict[str, Any], user_id: str,
+                                existing_entry: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Update a soil entry in the database
         
         Args:
             entry_id: Soil entry ID
             soil_data: Updated soil entry data
             user_id: Firebase user ID for authorization check
+            existing_entry: The entry as already fetched for this user, which
+                skips the authorization read
             
         Returns:
             Updated soil entry data
@@ -189,22 +233,23 @@ class DatabaseService:
         """
         try:
             # First get the existing entry to check authorization
-            existing_entry = await DatabaseService.get_soil_entry(entry_id, user_id)
+            if existing_entry is None:
+                existing_entry = await DatabaseService.get_soil_entry(entry_id, user_id)
             
             # Add updated timestamp
-            soil_data["updated_at"] = datetime.utcnow().isoformat()
+            stored, soil_data = _stamped(soil_data, "updated_at")
             
             # Update the document
-            success = update_document("soil_entries", entry_id, soil_data)
+            success = await update_document("soil_entries", entry_id, stored)
+            _entry_cache.pop(entry_id, None)
             if not success:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Failed to update soil entry"
                 )
             
-            # Get the updated entry
-            updated_entry = await DatabaseService.get_soil_entry(entry_id)
-            return updated_entry
+            # Merge the changes into the entry we already read
+            return {**existing_entry, **soil_data}
         except HTTPException:
             raise
         except Exception as e:
@@ -214,12 +259,14 @@ class DatabaseService:
             )
     
     @staticmethod
-    async def delete_soil_entry(entry_id: str, user_id: str) -> bool:
+    async def delete_soil_entry(entry_id: str, user_id: str, authorized: bool = False) -> bool:
         """Delete a soil entry from the database
         
         Args:
             entry_id: Soil entry ID
             user_id: Firebase user ID for authorization check
+            authorized: The caller already knows the user owns the entry,
+                e.g. it just created it, so skip the authorization read
             
         Returns:
             True if deletion was successful
@@ -229,10 +276,12 @@ class DatabaseService:
         """
         try:
             # First get the existing entry to check authorization
-            existing_entry = await DatabaseService.get_soil_entry(entry_id, user_id)
+            if not authorized:
+                await DatabaseService.get_soil_entry(entry_id, user_id)
             
             # Delete the document
-            success = delete_document("soil_entries", entry_id)
+            success = await delete_document("soil_entries", entry_id)
+            _entry_cache.pop(entry_id, None)
             if not success:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -249,7 +298,7 @@ class DatabaseService:
             )
     
     @staticmethod
-    async def create_story(user_id: str, entry_id: str, story_data: Dict[str, Any]) -> str:
+    async def create_story(user_id: str, entry_id: str, story_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create a new story in the database
         
         Args:
@@ -258,24 +307,90 @@ class DatabaseService:
             story_data: Story data including content, metadata, etc.
             
         Returns:
-            ID of the created story
+            The created story, including its ID
         """
         try:
             # Add user ID, entry ID, and timestamps
-            story_data["user_id"] = user_id
-            story_data["soil_entry_id"] = entry_id
-            story_data["created_at"] = datetime.utcnow().isoformat()
-            story_data["updated_at"] = story_data["created_at"]
+            stored, story_data = _stamped(
+                {**story_data, "user_id": user_id, "soil_entry_id": entry_id}, "created_at", "updated_at"
+            )
             
             # Add the document
-            story_id = add_document("stories", story_data)
-            return story_id
+            story_id = await add_document("stories", stored)
+            return {"id": story_id, **story_data}
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to create story: {str(e)}"
             )
     
+    @staticmethod
+    def new_story(user_id: str, entry_id: str, story_data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Prepare a story for :meth:`save_linked_story` without writing it
+        
+        Lets callers respond with the story, ID included, while the write
+        happens in the background.
+        
+        Args:
+            user_id: Firebase user ID
+            entry_id: Related soil entry ID
+            story_data: Story data including content, metadata, etc.
+            
+        Returns:
+            Tuple of (document to store, story as it will read back including its ID)
+        """
+        stored, story_data = _stamped(
+            {**story_data, "user_id": user_id, "soil_entry_id": entry_id}, "created_at", "updated_at"
+        )
+        return stored, {"id": new_document_id("stories"), **story_data}
+    
+    @staticmethod
+    async def save_linked_story(story_id: str, entry_id: str, stored: Dict[str, Any],
+                                analysis_results: Optional[Dict[str, Any]] = None) -> None:
+        """Write a story prepared by :meth:`new_story` and link it to its soil entry
+        
+        The story document and the entry's ``story_ids`` (plus its
+        ``analysis_results``, when given) commit in a single batch, so the
+        link can't be lost and the whole thing costs one round-trip. The
+        caller must already have checked that the user owns the entry.
+        
+        Args:
+            story_id: ID from new_story
+            entry_id: Related soil entry ID
+            stored: Document from new_story
+            analysis_results: Analysis to store on the entry alongside the link
+        """
+        entry_update = {
+            "story_ids": firestore.ArrayUnion([story_id]),
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        }
+        if analysis_results is not None:
+            entry_update["analysis_results"] = analysis_results
+        
+        await batch_write([
+            ("set", "stories", story_id, stored),
+            ("update", "soil_entries", entry_id, entry_update),
+        ])
+        _entry_cache.pop(entry_id, None)
+    
+    @staticmethod
+    async def create_linked_story(user_id: str, entry_id: str, story_data: Dict[str, Any],
+                                  analysis_results: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Create a story and link it to its soil entry in one atomic write
+        
+        Args:
+            user_id: Firebase user ID
+            entry_id: Related soil entry ID
+            story_data: Story data including content, metadata, etc.
+            analysis_results: Analysis to store on the entry alongside the link
+            
+        Returns:
+            The created story, including its ID
+        """
+        stored, story = DatabaseService.new_story(user_id, entry_id, story_data)
+        await DatabaseService.save_linked_story(story["id"], entry_id, stored, analysis_results)
+        return story
+    
     @staticmethod
     async def get_story(story_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
         """Get a story from the database
@@ -290,7 +405,7 @@ class DatabaseService:
         Raises:
             HTTPException: If story not found or user not authorized
         """
-        story_data = get_document("stories", story_id)
+        story_data = await get_document("stories", story_id)
         if not story_data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -306,6 +421,32 @@ class DatabaseService:
         
         return story_data
     
+    @staticmethod
+    async def update_story(story_id: str, story_data: Dict[str, Any], existing_story: Dict[str, Any]) -> Dict[str, Any]:
+        """Update a story in the database
+        
+        Args:
+            story_id: Story ID
+            story_data: Updated story fields
+            existing_story: The story as currently stored (already authorized)
+            
+        Returns:
+            Updated story data
+            
+        Raises:
+            HTTPException: If update fails
+        """
+        stored, story_data = _stamped(story_data, "updated_at")
+        
+        success = await update_document("stories", story_id, stored)
+        if not success:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to update story"
+            )
+        
+        return {**existing_story, "id": story_id, **story_data}
+    
     @staticmethod
     async def get_stories_for_entry(entry_id: str, user_id: str) -> List[Dict[str, Any]]:
         """Get all stories for a soil entry
@@ -318,15 +459,14 @@ class DatabaseService:
             List of stories
         """
         try:
-            # First check if the user is authorized to access this entry
-            await DatabaseService.get_soil_entry(entry_id, user_id)
-            
-            # Query stories for this entry
-            stories = query_collection("stories", "soil_entry_id", "==", entry_id)
-            
-            # Sort by created_at in descending order (newest first)
-            stories.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            
+            # Check that the user may access this entry while the stories
+            # are queried, rather than before
+            _, stories = await asyncio.gather(
+                DatabaseService.get_soil_entry(entry_id, user_id),
+                query_collection(
+                    "stories", "soil_entry_id", "==", entry_id, fields=STORY_LIST_FIELDS, order_by=NEWEST_FIRST
+                ),
+            )
             return stories
         except HTTPException:
             raise
@@ -348,17 +488,41 @@ class DatabaseService:
             List of stories
         """
         try:
-            stories = query_collection("stories", "user_id", "==", user_id, limit)
-            
-            # Sort by created_at in descending order (newest first)
-            stories.sort(key=lambda x: x.get("created_at", ""), reverse=True)
-            
-            return stories
+            return await query_collection(
+                "stories", "user_id", "==", user_id, limit, STORY_LIST_FIELDS, order_by=NEWEST_FIRST
+            )
         except Exception as e:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to get stories: {str(e)}"
             )
 
+    @staticmethod
+    async def create_pending_batch(batch_id: str, entries: List[Dict[str, str]]) -> None:
+        """Record an OpenAI batch whose analyses haven't been stored yet
+        
+        Args:
+            batch_id: OpenAI batch ID, also used as the document ID
+            entries: {"entry_id", "user_id"} for each soil entry in the batch
+        """
+        await add_document("pending_batches", {
+            "entries": entries,
+            "status": "pending",
+            "created_at": firestore.SERVER_TIMESTAMP,
+        }, batch_id)
+    
+    @staticmethod
+    async def get_pending_batches() -> List[Dict[str, Any]]:
+        """Get batches still waiting for results"""
+        return await query_collection("pending_batches", "status", "==", "pending")
+    
+    @staticmethod
+    async def finish_pending_batch(batch_id: str, batch_status: str) -> None:
+        """Mark a pending batch as completed or failed"""
+        await update_document("pending_batches", batch_id, {
+            "status": batch_status,
+            "updated_at": firestore.SERVER_TIMESTAMP,
+        })
+
 # Create a singleton instance
 db_service = DatabaseService()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import hashlib
+import orjson
+from typing import Any, Optional
+
+from app.core.cache import cache_get, cache_set
+
+# Completions are content-addressed, so they can live much longer than the
+# per-user response cache
+LLM_CACHE_TTL = 86400
+
+class LLMCache:
+    """Exact-match cache for AI provider results, stored in Redis
+    
+    Keys are a SHA-256 of the canonical JSON of everything that shapes the
+    completion, so identical requests share one entry regardless of user.
+    Without Redis every lookup misses and writes are dropped.
+    """
+    
+    @staticmethod
+    def key(kind: str, provider: str, inputs: Any) -> str:
+        """Build the cache key for a request
+        
+        Args:
+            kind: What is being generated, e.g. "analysis" or "story"
+            provider: The AI provider that will answer it
+            inputs: JSON-encodable request inputs
+            
+        Returns:
+            Redis key for the cached result
+        """
+        canonical = orjson.dumps(inputs, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+        digest = hashlib.sha256(canonical).hexdigest()
+        return f"llm:{kind}:{provider}:{digest}"
+    
+    @staticmethod
+    async def get(key: str) -> Optional[Any]:
+        """Return the cached result for key, or None on a miss"""
+        return await cache_get(key)
+    
+    @staticmethod
+    async def set(key: str, value: Any, ttl: int = LLM_CACHE_TTL) -> None:
+        """Cache a provider result under key"""
+        await cache_set(key, value, ttl)
+
+# Create a singleton instance
+llm_cache = LLMCache()
@@ -1,11 +1,55 @@
+import asyncio
+import logging
 import os
 import uuid
 from typing import List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
-from PIL import Image
+from PIL import Image, features
 import io
 from app.core.config import settings
-from app.core.firebase import upload_file, delete_file
+from app.core.firebase import upload_file, delete_file, get_public_url
+
+logger = logging.getLogger(__name__)
+
+# Pillow's wheels bundle libjpeg-turbo (SIMD Huffman, IDCT and colour
+# conversion); builds against plain libjpeg code uploads several times slower
+if not features.check_feature("libjpeg_turbo"):
+    logger.warning("Pillow is not using libjpeg-turbo; JPEG decoding and encoding will be slow")
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJCS_YCbCr, TJCS_GRAY
+    _turbo = TurboJPEG()
+except (ImportError, OSError, RuntimeError):  # Optional; PIL handles every image without it
+    _turbo = None
+
+def _turbo_scaling_factor(width: int, height: int, max_size: int) -> Optional[Tuple[int, int]]:
+    """Largest TurboJPEG downscaling factor that fits the longer side in max_size"""
+    longest = max(width, height)
+    # Scaled sizes round up, as libjpeg-turbo's TJSCALED does
+    fits = [
+        (num, denom) for num, denom in _turbo.scaling_factors
+        if num <= denom and -(-longest * num // denom) <= max_size
+    ]
+    return max(fits, key=lambda sf: sf[0] / sf[1]) if fits else None
+
+def _process_jpeg_turbo(contents: bytes, max_size: int) -> Optional[bytes]:
+    """Resize and re-encode a JPEG with libjpeg-turbo in one scaled decode
+    
+    The downscale happens inside the IDCT, so no full-resolution image is
+    ever built. Returns None if no scaling factor is small enough or the
+    colour space (e.g. CMYK) is left to PIL.
+    """
+    width, height, _, colorspace = _turbo.decode_header(contents)
+    scaling_factor = _turbo_scaling_factor(width, height, max_size)
+    if scaling_factor is None or colorspace not in (TJCS_YCbCr, TJCS_GRAY):
+        return None
+    if colorspace == TJCS_YCbCr:
+        # Colour JPEGs are transcoded through YUV planes, skipping the
+        # YCbCr<->RGB conversion both ways; the chroma subsampling is kept
+        return _turbo.scale_with_quality(contents, scaling_factor=scaling_factor, quality=85)
+    # Grayscale sources go through RGB so the output is always colour
+    pixels = _turbo.decode(contents, pixel_format=TJPF_RGB, scaling_factor=scaling_factor)
+    return _turbo.encode(pixels, quality=85, pixel_format=TJPF_RGB)
 
 def validate_image(file: UploadFile) -> bool:
     """Validate that the uploaded file is an image with allowed extension
@@ -27,12 +71,37 @@ def validate_image(file: UploadFile) -> bool:
     
     return True
 
-async def save_upload_file(file: UploadFile, user_id: str) -> Tuple[str, str]:
+def reserve_upload_path(file: UploadFile, user_id: str) -> Tuple[str, str]:
+    """Validate an upload and choose where it will live in Firebase Storage
+    
+    Nothing is uploaded; this lets callers know the final path and URL
+    before the upload finishes, e.g. to write the database record alongside it.
+    
+    Args:
+        file: The uploaded file
+        user_id: The ID of the user uploading the file
+        
+    Returns:
+        Tuple of (file_path, public_url)
+        
+    Raises:
+        HTTPException: If the file is not an allowed image
+    """
+    if not validate_image(file):
+        raise HTTPException(status_code=400, detail="Invalid file format. Only JPG, JPEG, and PNG are allowed.")
+    
+    # Generate a unique filename
+    ext = file.filename.split('.')[-1].lower() if file.filename else 'jpg'
+    file_path = f"soil_photos/{user_id}/{uuid.uuid4()}.{ext}"
+    return file_path, get_public_url(file_path)
+
+async def save_upload_file(file: UploadFile, user_id: str, file_path: Optional[str] = None) -> Tuple[str, str]:
     """Save an uploaded file to Firebase Storage
     
     Args:
         file: The uploaded file
         user_id: The ID of the user uploading the file
+        file_path: Destination from reserve_upload_path, if already chosen
         
     Returns:
         Tuple of (file_path, public_url)
@@ -41,22 +110,13 @@ async def save_upload_file(file: UploadFile, user_id: str) -> Tuple[str, str]:
         HTTPException: If the file cannot be saved
     """
     try:
-        # Validate the file
-        if not validate_image(file):
-            raise HTTPException(status_code=400, detail="Invalid file format. Only JPG, JPEG, and PNG are allowed.")
-        
-        # Read file content
-        contents = await file.read()
+        if file_path is None:
+            file_path, _ = reserve_upload_path(file, user_id)
         
-        # Generate a unique filename
-        ext = file.filename.split('.')[-1].lower() if file.filename else 'jpg'
-        filename = f"{uuid.uuid4()}.{ext}"
-        
-        # Define the path in Firebase Storage
-        file_path = f"soil_photos/{user_id}/{filename}"
-        
-        # Upload to Firebase Storage
-        public_url = upload_file(contents, file_path)
+        # Stream the spooled upload to Firebase Storage without copying it
+        # into memory; the client is blocking, so it runs in a worker thread
+        # to keep the event loop (and the entry write it's gathered with) free
+        public_url = await asyncio.to_thread(upload_file, file.file, file_path, file.content_type)
         
         return file_path, public_url
     except HTTPException:
@@ -77,17 +137,26 @@ async def process_image(file: UploadFile) -> bytes:
         HTTPException: If the image cannot be processed
     """
     try:
-        # Read file content
-        contents = await file.read()
+        max_size = 1024  # Maximum dimension
         
-        # Reset file pointer for future reads
+        # With PyTurboJPEG installed, JPEGs skip PIL entirely
         await file.seek(0)
-        
-        # Open image with PIL
-        img = Image.open(io.BytesIO(contents))
+        if _turbo is not None and file.file.read(2) == b"\xff\xd8":
+            await file.seek(0)
+            processed_image = _process_jpeg_turbo(await file.read(), max_size)
+            await file.seek(0)
+            if processed_image is not None:
+                return processed_image
+        
+        # Decode straight from the spooled upload rather than a copy in memory
+        await file.seek(0)
+        img = Image.open(file.file)
         
         # Resize if needed (e.g., for AI model requirements)
-        max_size = 1024  # Maximum dimension
+        # Let JPEGs decode straight to the smallest 1/2, 1/4 or 1/8 scale that
+        # still covers max_size; img.size reflects the reduced size afterwards,
+        # so LANCZOS only handles what's left. No-op for other formats.
+        img.draft('RGB', (max_size, max_size))
         if max(img.size) > max_size:
             # Calculate new dimensions while preserving aspect ratio
             ratio = max_size / max(img.size)
@@ -103,13 +172,24 @@ async def process_image(file: UploadFile) -> bytes:
         img.save(output, format='JPEG', quality=85)
         processed_image = output.getvalue()
         
+        # Reset file pointer for future reads
+        await file.seek(0)
+        
         return processed_image
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not process image: {str(e)}")
 
+# EXIF tags worth keeping with a soil entry (DateTime, Make, Model, DateTimeOriginal)
+_EXIF_TAGS = {0x0132: "datetime", 0x010F: "camera_make", 0x0110: "camera_model"}
+_EXIF_SUB_TAGS = {0x9003: "datetime_original"}
+
 def extract_image_metadata(file: UploadFile) -> dict:
     """Extract metadata from an image file
     
+    Only headers are read: PIL parses the JPEG markers (including the APP1
+    EXIF segment) without decoding pixel data. This is blocking file I/O, so
+    call it via ``asyncio.to_thread`` from async code.
+    
     Args:
         file: The uploaded image file
         
@@ -123,17 +203,37 @@ def extract_image_metadata(file: UploadFile) -> dict:
     }
     
     try:
-        # Get file size
         file_object = file.file
         position = file_object.tell()
-        file_object.seek(0, os.SEEK_END)
-        metadata["size"] = file_object.tell()
-        file_object.seek(position)  # Reset position
         
-        # Additional metadata could be extracted here, such as EXIF data
-        # This would require reading the file and using a library like PIL's ExifTags
+        # Starlette counts the bytes as it spools the upload; only seek to
+        # the end for an UploadFile built without a size
+        if file.size is not None:
+            metadata["size"] = file.size
+        elif file.headers.get("content-length", "").isdigit():
+            metadata["size"] = int(file.headers["content-length"])
+        else:
+            file_object.seek(0, os.SEEK_END)
+            metadata["size"] = file_object.tell()
+        
+        try:
+            file_object.seek(0)
+            with Image.open(file_object) as img:
+                metadata["width"], metadata["height"] = img.size
+                # Only JPEGs carry EXIF from phone cameras; skip the lookup otherwise
+                if img.format == "JPEG":
+                    exif = img.getexif()
+                    for tag, name in _EXIF_TAGS.items():
+                        if tag in exif:
+                            metadata[name] = str(exif[tag]).strip("\x00 ")
+                    sub_ifd = exif.get_ifd(0x8769)
+                    for tag, name in _EXIF_SUB_TAGS.items():
+                        if tag in sub_ifd:
+                            metadata[name] = str(sub_ifd[tag]).strip("\x00 ")
+        finally:
+            file_object.seek(position)  # Reset position
         
     except Exception as e:
-        print(f"Error extracting metadata: {e}")
+        logger.warning("Error extracting metadata: %s", e)
     
     return metadata
\ No newline at end of file
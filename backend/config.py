@@ -1,14 +1,22 @@
 import os
+from functools import lru_cache
 from pathlib import Path
 
 
 class AppConfig:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret')
 
+    # Worker threads for blocking calls offloaded from the event loop
+    # (asyncio.to_thread); these mostly wait on disk and network I/O
+    IO_THREADS = int(os.environ.get('IO_THREADS', '64'))
+
     # Storage
     BASE_DIR = Path(__file__).resolve().parents[1]
     UPLOADS_DIR = os.environ.get('UPLOADS_DIR', str(BASE_DIR / 'storage' / 'uploads'))
     MEDIA_DIR = os.environ.get('MEDIA_DIR', str(BASE_DIR / 'storage' / 'media'))
+    # Internal nginx location aliased to MEDIA_DIR (e.g. /_media/); when set,
+    # /media/<file> answers with X-Accel-Redirect and nginx sends the file
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '')
 
     # Firebase
     FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID', '')
@@ -26,6 +34,9 @@ class AppConfig:
     TTS_PROVIDER = os.environ.get('TTS_PROVIDER', 'gtts')  # gtts or elevenlabs
     VIDEO_PROVIDER = os.environ.get('VIDEO_PROVIDER', 'gemini')  # gemini (default), local, or veo
     ELEVENLABS_API_KEY = os.environ.get('ELEVENLABS_API_KEY', '')
+    # Synthesized narration is kept under MEDIA_DIR/tts_cache, keyed by text,
+    # and the least recently used files are evicted past this size
+    TTS_CACHE_MAX_MB = int(os.environ.get('TTS_CACHE_MAX_MB', '256'))
 
     # Google Cloud / Vertex AI (for Veo)
     GCP_PROJECT_ID = os.environ.get('GCP_PROJECT_ID', '')
@@ -36,4 +47,12 @@ class AppConfig:
     # Gemini Video Generation
     GEMINI_VIDEO_MODEL = os.environ.get('GEMINI_VIDEO_MODEL', 'gemini-1.5-flash-exp')
 
+    # Seconds a remote video provider gets before local generation is started
+    # alongside it; whichever finishes first is used
+    VIDEO_HEDGE_SECONDS = float(os.environ.get('VIDEO_HEDGE_SECONDS', '20'))
+
 
+@lru_cache(maxsize=1)
+def get_config() -> AppConfig:
+    """The process-wide AppConfig instance"""
+    return AppConfig()
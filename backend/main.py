@@ -1,6 +1,8 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import uvicorn
@@ -11,6 +13,22 @@ from app.routers import auth, soil_photos, stories, users
 
 # Import config
 from app.core.config import settings
+from app.core.cache import init_cache, close_cache
+from app.core.logging import start_logging, stop_logging
+from app.services.ai_service import ai_service
+from app.services.batch_service import run_batch_poller
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_logging()
+    await init_cache()
+    batch_poller = asyncio.create_task(run_batch_poller()) if ai_service.batch_enabled else None
+    yield
+    if batch_poller is not None:
+        batch_poller.cancel()
+    await close_cache()
+    await ai_service.aclose()
+    stop_logging()
 
 # Create FastAPI app
 app = FastAPI(
@@ -19,7 +37,9 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -40,18 +60,27 @@ app.include_router(stories.router, prefix="/api", tags=["Stories"])
 # Exception handlers
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail},
     )
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=422,
         content={"detail": str(exc)},
     )
 
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request, exc):
+    # Route handlers don't wrap their bodies in try/except; anything that
+    # isn't an HTTPException ends up here as a 500
+    return ORJSONResponse(
+        status_code=500,
+        content={"detail": f"Internal error: {exc}"},
+    )
+
 @app.get("/api/health", tags=["Health"])
 async def health_check():
     return {"status": "healthy"}
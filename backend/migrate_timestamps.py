@@ -0,0 +1,82 @@
+"""Convert ISO-string created_at/updated_at fields to Firestore timestamps
+
+Documents used to store their timestamps as ``datetime.utcnow().isoformat()``
+strings; they are now written as server timestamps. Firestore orders values
+by type before value, so until old documents are converted, lists sorted by
+created_at put every string-dated document on one side of the
+timestamp-dated ones. Run this once per project when deploying that change:
+
+    python migrate_timestamps.py          # convert
+    python migrate_timestamps.py --dry-run  # only count
+
+It is safe to re-run; documents that already hold timestamps are skipped.
+"""
+
+import sys
+from datetime import datetime, timezone
+
+from app.core.firebase import get_db
+
+COLLECTIONS = ["users", "soil_entries", "stories"]
+TIMESTAMP_FIELDS = ["created_at", "updated_at"]
+
+# Firestore allows at most 500 writes per batch
+BATCH_SIZE = 400
+
+def parse_timestamp(value):
+    """Parse a stored ISO string; naive values were written in UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def migrate_collection(db, collection, dry_run=False):
+    """Convert one collection, returning (converted, skipped) document counts"""
+    converted = 0
+    skipped = 0
+    batch = db.batch()
+    pending = 0
+
+    for doc in db.collection(collection).select(TIMESTAMP_FIELDS).stream():
+        data = doc.to_dict() or {}
+        updates = {}
+        for field in TIMESTAMP_FIELDS:
+            value = data.get(field)
+            if isinstance(value, str):
+                try:
+                    updates[field] = parse_timestamp(value)
+                except ValueError:
+                    print(f"⚠️ {collection}/{doc.id}: unparseable {field} {value!r}, left as is")
+        if not updates:
+            skipped += 1
+            continue
+
+        converted += 1
+        if dry_run:
+            continue
+        batch.update(doc.reference, updates)
+        pending += 1
+        if pending == BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+    return converted, skipped
+
+def main():
+    """Convert every collection"""
+    dry_run = "--dry-run" in sys.argv[1:]
+    db = get_db()
+    if db is None:
+        print("❌ Firebase is not configured; nothing to migrate")
+        sys.exit(1)
+
+    for collection in COLLECTIONS:
+        converted, skipped = migrate_collection(db, collection, dry_run)
+        action = "would convert" if dry_run else "converted"
+        print(f"✅ {collection}: {action} {converted} documents, {skipped} already up to date")
+
+if __name__ == "__main__":
+    main()
@@ -1,84 +1,255 @@
 import base64
 import io
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 import numpy as np
 import cv2
 
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except Exception:
+    _HAS_NUMBA = False
+
+try:
+    # libjpeg-turbo SIMD decoder; the shared library may be absent even if
+    # the Python wrapper is installed, so probe it by instantiating
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _TURBOJPEG = TurboJPEG()
+except Exception:
+    _TURBOJPEG = None
+
+_JPEG_MAGIC = b'\xff\xd8\xff'
+
 
 _MODELS_DIR = Path('Machine Learning/Deployed models testing')
 
 
+_MODEL_FILES = {
+    'P': 'Pclassifier.pkl',
+    'pH': 'pHclassifier.pkl',
+    'OM': 'OMclassifier.pkl',
+    'EC': 'ECclassifier.pkl',
+}
+
+
 def _load_models():
     import pickle
     models = {}
-    try:
-        with open(_MODELS_DIR / 'Pclassifier.pkl', 'rb') as f:
-            models['P'] = pickle.load(f)
-    except Exception:
-        models['P'] = None
-    try:
-        with open(_MODELS_DIR / 'pHclassifier.pkl', 'rb') as f:
-            models['pH'] = pickle.load(f)
-    except Exception:
-        models['pH'] = None
-    try:
-        with open(_MODELS_DIR / 'OMclassifier.pkl', 'rb') as f:
-            models['OM'] = pickle.load(f)
-    except Exception:
-        models['OM'] = None
-    try:
-        with open(_MODELS_DIR / 'ECclassifier.pkl', 'rb') as f:
-            models['EC'] = pickle.load(f)
-    except Exception:
-        models['EC'] = None
+    for key, filename in _MODEL_FILES.items():
+        try:
+            with open(_MODELS_DIR / filename, 'rb') as f:
+                models[key] = pickle.load(f)
+        except Exception:
+            models[key] = None
     return models
 
 
-_CACHED_MODELS = None
+@lru_cache(maxsize=None)
+def _get_models():
+    return _load_models()
 
 
-def _get_models():
-    global _CACHED_MODELS
-    if _CACHED_MODELS is None:
-        _CACHED_MODELS = _load_models()
-    return _CACHED_MODELS
+class BufferPool:
+    """Per-thread scratch arrays reused across requests.
 
+    Each named slot keeps one flat slab that grows on demand and is never
+    shrunk; ``get`` returns a view of it with the requested shape. A view is
+    valid until the same slot is requested again on the same thread.
+    """
 
-def _extract_temp_feature(image_bgr: np.ndarray) -> float:
-    blue_channel = image_bgr[:, :, 0]
-    green_channel = image_bgr[:, :, 1]
-    red_channel = image_bgr[:, :, 2]
-    value = (np.median(green_channel) + np.median(blue_channel)) + np.median(red_channel)
-    return float(np.nanmean(value))
+    def __init__(self):
+        self._slabs: Dict[str, np.ndarray] = {}
 
+    def get(self, name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        slab = self._slabs.get(name)
+        if slab is None or slab.dtype != dtype or slab.size < size:
+            slab = np.empty(size, dtype=dtype)
+            self._slabs[name] = slab
+        return slab[:size].reshape(shape)
+
+
+_SCRATCH = threading.local()
+
+
+def get_scratch() -> BufferPool:
+    pool = getattr(_SCRATCH, 'pool', None)
+    if pool is None:
+        pool = _SCRATCH.pool = BufferPool()
+    return pool
+
+
+def _median_from_hist(hist: np.ndarray, n: int) -> float:
+    # Same result as np.median over the counted values: the middle value for
+    # an odd count, the mean of the two middle values for an even one.
+    lo_rank = (n - 1) // 2
+    hi_rank = n // 2
+    lo = -1
+    hi = -1
+    seen = 0
+    for v in range(hist.shape[0]):
+        seen += hist[v]
+        if lo < 0 and seen > lo_rank:
+            lo = v
+        if seen > hi_rank:
+            hi = v
+            break
+    return (lo + hi) / 2.0
+
+
+def _channel_median_sum(image_bgr: np.ndarray, hists: np.ndarray) -> float:
+    # One pass over the pixels builds per-channel 256-bin histograms; medians
+    # of uint8 data then fall out of the cumulative counts without sorting.
+    rows = image_bgr.shape[0]
+    cols = image_bgr.shape[1]
+    n_chunks = hists.shape[0]
+    hists[:] = 0
+    for c in prange(n_chunks):
+        start = rows * c // n_chunks
+        stop = rows * (c + 1) // n_chunks
+        for i in range(start, stop):
+            for j in range(cols):
+                hists[c, 0, image_bgr[i, j, 0]] += 1
+                hists[c, 1, image_bgr[i, j, 1]] += 1
+                hists[c, 2, image_bgr[i, j, 2]] += 1
+    total = hists.sum(axis=0)
+    n = rows * cols
+    return _median_from_hist(total[1], n) + _median_from_hist(total[0], n) + _median_from_hist(total[2], n)
+
+
+def _luma_std(image_bgr: np.ndarray) -> float:
+    # Grayscale standard deviation without materializing the gray image.
+    # Luma uses OpenCV's classic 14-bit fixed-point BGR2GRAY weights; builds
+    # with SIMD colour conversion round a few pixels differently, so this
+    # agrees with np.std(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)) to ~1e-3.
+    rows = image_bgr.shape[0]
+    cols = image_bgr.shape[1]
+    total = 0
+    total_sq = 0
+    for i in prange(rows):
+        for j in range(cols):
+            y = (np.int64(image_bgr[i, j, 0]) * 1868 + np.int64(image_bgr[i, j, 1]) * 9617
+                 + np.int64(image_bgr[i, j, 2]) * 4899 + 8192) >> 14
+            total += y
+            total_sq += y * y
+    n = rows * cols
+    mean = total / n
+    return np.sqrt(max(total_sq / n - mean * mean, 0.0))
 
-def analyze_image_bytes(image_bytes: bytes) -> Dict[str, Any]:
-    np_arr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    if image is None:
-        raise ValueError('Invalid image data')
 
-    feature = _extract_temp_feature(image)
+if _HAS_NUMBA:
+    _median_from_hist = njit(nogil=True, cache=True)(_median_from_hist)
+    _channel_median_sum = njit(parallel=True, nogil=True, cache=True)(_channel_median_sum)
+    _luma_std = njit(parallel=True, nogil=True, cache=True)(_luma_std)
 
+
+def _extract_temp_feature(image_bgr: np.ndarray, scratch: Optional[BufferPool] = None) -> float:
+    if _HAS_NUMBA and image_bgr.dtype == np.uint8 and image_bgr.size:
+        scratch = scratch or get_scratch()
+        hists = scratch.get('hist', (min(image_bgr.shape[0], 16), 3, 256), np.int64)
+        return float(_channel_median_sum(image_bgr, hists))
+    # One median reduction over (pixels, channel) instead of one per channel
+    blue, green, red = np.median(image_bgr.reshape(-1, 3), axis=0)
+    return float((green + blue) + red)
+
+
+def warm_up() -> None:
+    """Load the models and compile the numba kernels ahead of the first request
+
+    Called while the app is created, so a server that forks workers after
+    importing the app shares the unpickled models copy-on-write instead of
+    each worker loading them on its first upload.
+    """
+    _get_models()
+    if _HAS_NUMBA:
+        _extract_temp_feature(np.zeros((1, 1, 3), dtype=np.uint8))
+        _luma_std(np.zeros((1, 1, 3), dtype=np.uint8))
+
+
+@lru_cache(maxsize=4096)
+def _predict_nutrients(feature: float) -> Tuple[Tuple[str, float], ...]:
+    # The feature is a sum of three uint8 medians, so it only takes values in
+    # 0.5 steps over [0, 765]; caching on it exactly replays the predictions
+    # without re-running each model's input validation for repeat values.
     models = _get_models()
-    results = {}
-    for key in ['P', 'pH', 'OM', 'EC']:
+    x = np.asarray([[feature]], dtype=np.float64)
+    results = []
+    for key in _MODEL_FILES:
         model = models.get(key)
         try:
             if model is not None:
-                pred = float(model.predict([[feature]]))
+                pred = float(model.predict(x)[0])
             else:
                 pred = float(feature % 10)
         except Exception:
             pred = float(feature % 10)
-        results[key] = round(pred, 3)
+        results.append((key, round(pred, 3)))
+    return tuple(results)
+
+
+# JPEGs are decoded at a reduced scale for analysis; the features are
+# whole-image statistics, so the smallest DCT scale that keeps the shorter
+# side at or above this many pixels is used instead of full resolution
+ANALYSIS_MIN_SIDE = 512
+
+_CV2_REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def _jpeg_size(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    if _TURBOJPEG is not None:
+        width, height, _, _ = _TURBOJPEG.decode_header(image_bytes)
+        return width, height
+    from PIL import Image
+    # Only the header is parsed here; no pixels are decoded
+    return Image.open(io.BytesIO(image_bytes)).size
+
+
+def _decode_bgr(image_bytes: bytes) -> Optional[np.ndarray]:
+    if image_bytes[:3] == _JPEG_MAGIC:
+        try:
+            short_side = min(_jpeg_size(image_bytes))
+            if _TURBOJPEG is not None:
+                # Scaled sizes round up, as libjpeg-turbo's TJSCALED does
+                num, denom = min(
+                    (f for f in _TURBOJPEG.scaling_factors
+                     if f[0] <= f[1] and -(-short_side * f[0] // f[1]) >= ANALYSIS_MIN_SIDE),
+                    key=lambda f: f[0] / f[1], default=(1, 1),
+                )
+                return _TURBOJPEG.decode(image_bytes, pixel_format=TJPF_BGR, scaling_factor=(num, denom))
+            reduction = max((r for r in _CV2_REDUCED if -(-short_side // r) >= ANALYSIS_MIN_SIDE), default=None)
+            if reduction is not None:
+                image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), _CV2_REDUCED[reduction])
+                if image is not None:
+                    return image
+        except Exception:
+            pass
+    np_arr = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+
+def analyze_image_bytes(image_bytes: bytes, scratch: Optional[BufferPool] = None) -> Dict[str, Any]:
+    scratch = scratch or get_scratch()
+    image = _decode_bgr(image_bytes)
+    if image is None:
+        raise ValueError('Invalid image data')
+
+    feature = _extract_temp_feature(image, scratch)
+
+    results = dict(_predict_nutrients(feature))
 
     # Add a naive moisture proxy from intensity spread
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    moisture_proxy = float(1.0 - (np.std(gray) / 128.0))
+    if _HAS_NUMBA and image.dtype == np.uint8:
+        gray_std = float(_luma_std(image))
+    else:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=scratch.get('gray', image.shape[:2]))
+        gray_std = float(np.std(gray))
+    moisture_proxy = float(1.0 - (gray_std / 128.0))
     moisture_proxy = max(0.0, min(1.0, moisture_proxy))
     results['moisture'] = round(moisture_proxy, 3)
 
@@ -1,6 +1,6 @@
 import functools
 from typing import Callable, Dict, Any
-from flask import request, jsonify, session
+from quart import request, jsonify, session
 import uuid
 
 from ..config import AppConfig
@@ -9,7 +9,7 @@ from ..config import AppConfig
 def require_firebase_auth(view: Callable):
     """Simple local authentication - no Firebase needed."""
     @functools.wraps(view)
-    def wrapper(*args, **kwargs):
+    async def wrapper(*args, **kwargs):
         # Get user ID from session or create a new one
         if 'user_id' not in session:
             session['user_id'] = str(uuid.uuid4())
@@ -19,7 +19,7 @@ def require_firebase_auth(view: Callable):
             "uid": session['user_id'],
             "email": session['email'],
         }
-        return view(user=user, *args, **kwargs)
+        return await view(user=user, *args, **kwargs)
     return wrapper
 
 
@@ -1,10 +1,77 @@
-import json
+import base64
+import hashlib
 import os
+import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 from pathlib import Path
 import uuid
 
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows; appends are left unlocked there
+    fcntl = None
+
+
+# How many analyses db_get_user_history returns, newest first
+HISTORY_LIMIT = 50
+
+# Threads used to read a history's records concurrently
+HISTORY_READ_THREADS = 16
+
+# Fixed layout of the analyzer output; records store it as packed
+# little-endian float32 values under 'analysisPacked'. float32 (not float16)
+# keeps the analyzer's 3-decimal rounding exact after round-tripping.
+ANALYSIS_SCHEMA = ('P', 'pH', 'OM', 'EC', 'moisture')
+_ANALYSIS_STRUCT = struct.Struct(f'<{len(ANALYSIS_SCHEMA)}f')
+
+
+def _pack_analysis(analysis: Any) -> Optional[str]:
+    if not isinstance(analysis, dict) or set(analysis) != set(ANALYSIS_SCHEMA):
+        return None
+    try:
+        packed = _ANALYSIS_STRUCT.pack(*(float(analysis[k]) for k in ANALYSIS_SCHEMA))
+    except (TypeError, ValueError, struct.error):
+        return None
+    return base64.b64encode(packed).decode('ascii')
+
+
+def _unpack_analysis(record: Dict[str, Any]) -> Dict[str, Any]:
+    packed = record.pop('analysisPacked', None)
+    if packed is not None:
+        values = _ANALYSIS_STRUCT.unpack(base64.b64decode(packed))
+        record['analysis'] = {k: round(v, 3) for k, v in zip(ANALYSIS_SCHEMA, values)}
+    return record
+
+
+def _to_stored(record: Dict[str, Any]) -> Dict[str, Any]:
+    packed = _pack_analysis(record.get('analysis'))
+    if packed is None:
+        return record
+    stored = {k: v for k, v in record.items() if k != 'analysis'}
+    stored['analysisPacked'] = packed
+    return stored
+
+
+# Indented for readability on disk; NumPy scalars from the analyzer are
+# written natively and anything else orjson can't encode falls back to str
+_DUMP_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _write_record(file_path: Path, record: Dict[str, Any]) -> None:
+    with open(file_path, 'wb') as f:
+        f.write(orjson.dumps(_to_stored(record), default=str, option=_DUMP_OPTIONS))
+
+
+def _read_record(file_path: Path) -> Dict[str, Any]:
+    with open(file_path, 'rb') as f:
+        return orjson.loads(f.read())
+
 
 def _get_data_dir() -> Path:
     """Get the local data directory for storing analyses."""
@@ -13,6 +80,71 @@ def _get_data_dir() -> Path:
     return data_dir
 
 
+_SAFE_UID = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+
+def _user_index_path(uid: str) -> Path:
+    # One append-only file per user listing their analysis IDs, oldest first
+    index_dir = _get_data_dir() / 'by_user'
+    index_dir.mkdir(exist_ok=True)
+    name = uid if _SAFE_UID.match(uid) else hashlib.sha256(uid.encode('utf-8')).hexdigest()
+    return index_dir / f"{name}.idx"
+
+
+def _append_line(path: Path, line: str) -> None:
+    with open(path, 'a', encoding='utf-8') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(line)
+
+
+def _ensure_user_index(uid: str) -> Path:
+    """Return the user's index file, building it from a full scan the first time
+
+    Records written before the index existed are picked up here once; after
+    that the index is kept current by db_create_analysis.
+    """
+    index_path = _user_index_path(uid)
+    if index_path.exists():
+        return index_path
+
+    owned = []
+    for file_path in _get_data_dir().glob("*.json"):
+        try:
+            record = _read_record(file_path)
+        except Exception:
+            continue
+        if record.get('userId') == uid and record.get('id'):
+            owned.append((record.get('createdAt', ''), record['id']))
+    owned.sort()
+
+    tmp_path = index_path.with_suffix(f'.{uuid.uuid4().hex}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(f"{analysis_id}\n" for _, analysis_id in owned)
+    try:
+        # Another request may have built it meanwhile; keep theirs
+        os.link(tmp_path, index_path)
+    except FileExistsError:
+        pass
+    finally:
+        tmp_path.unlink()
+    return index_path
+
+
+def _tail_ids(index_path: Path, count: int) -> List[str]:
+    # IDs are fixed-length UUIDs, so the last `count` lines sit within a
+    # small window at the end of the file
+    window = count * 64
+    with open(index_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - window))
+        lines = f.read().decode('utf-8').splitlines()
+    if size > window:
+        lines = lines[1:]  # Possibly a partial line
+    return [line for line in lines if line][-count:]
+
+
 def db_create_analysis(record: Dict[str, Any]) -> str:
     """Create a new analysis record in local JSON storage."""
     data_dir = _get_data_dir()
@@ -21,10 +153,18 @@ def db_create_analysis(record: Dict[str, Any]) -> str:
     analysis_id = str(uuid.uuid4())
     record['id'] = analysis_id
     
+    # Make sure the owner's index exists first, so a first-time scan can't
+    # pick up this record as well as the append below
+    uid = record.get('userId')
+    index_path = _ensure_user_index(uid) if uid else None
+    
     # Save to JSON file
     file_path = data_dir / f"{analysis_id}.json"
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(record, f, indent=2, default=str)
+    _write_record(file_path, record)
+    
+    # Record it in the owner's history index
+    if index_path is not None:
+        _append_line(index_path, f"{analysis_id}\n")
     
     return analysis_id
 
@@ -38,8 +178,7 @@ def db_get_analysis(doc_id: str) -> Optional[Dict[str, Any]]:
         return None
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return _unpack_analysis(_read_record(file_path))
     except Exception:
         return None
 
@@ -56,27 +195,18 @@ def db_update_analysis_video(doc_id: str, data: Dict[str, Any]) -> None:
     # Save back to file
     data_dir = _get_data_dir()
     file_path = data_dir / f"{doc_id}.json"
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(analysis, f, indent=2, default=str)
+    _write_record(file_path, analysis)
 
 
-def db_get_user_history(uid: str) -> List[Dict[str, Any]]:
-    """Get all analyses for a user from local storage."""
-    data_dir = _get_data_dir()
-    items = []
-    
-    # Read all JSON files in the data directory
-    for file_path in data_dir.glob("*.json"):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                record = json.load(f)
-                if record.get('userId') == uid:
-                    items.append(record)
-        except Exception:
-            continue
-    
-    # Sort by creation date (newest first)
-    items.sort(key=lambda x: x.get('createdAt', ''), reverse=True)
-    return items[:50]  # Limit to 50 most recent
+@lru_cache(maxsize=None)
+def _history_read_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=HISTORY_READ_THREADS, thread_name_prefix='db-read')
 
 
+def db_get_user_history(uid: str) -> List[Dict[str, Any]]:
+    """Get the most recent analyses for a user from local storage."""
+    # Only the records named at the end of the user's index are read, and
+    # their files are opened concurrently so storage latency overlaps
+    analysis_ids = list(reversed(_tail_ids(_ensure_user_index(uid), HISTORY_LIMIT)))
+    records = _history_read_pool().map(db_get_analysis, analysis_ids)
+    return [record for record in records if record is not None and record.get('userId') == uid]
@@ -1,28 +1,73 @@
-import json
+import asyncio
+import base64
+import hashlib
+import hmac
 import os
 from pathlib import Path
 from typing import Dict, Optional, List
 from functools import wraps
-from flask import request, jsonify, current_app
+import orjson
+from quart import request, jsonify, current_app
 
 # Path to the credentials file
 CREDENTIALS_FILE = Path(__file__).resolve().parents[2] / 'auth_credentials.json'
 
+# scrypt cost parameters (~50ms and 16 MiB per hash); stored with each hash
+# so they can be raised later without invalidating existing passwords
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+_HASH_PREFIX = 'scrypt$'
+
+def hash_password(password: str) -> str:
+    """Hash a password as ``scrypt$n$r$p$salt$hash`` (base64 salt and hash)"""
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return _HASH_PREFIX + '$'.join([
+        str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P),
+        base64.b64encode(salt).decode('ascii'), base64.b64encode(digest).decode('ascii'),
+    ])
+
+def verify_password(stored: str, password: str) -> bool:
+    """Check a password against a hash from hash_password in constant time"""
+    try:
+        n, r, p, salt, expected = stored[len(_HASH_PREFIX):].split('$')
+        expected = base64.b64decode(expected)
+        digest = hashlib.scrypt(
+            password.encode('utf-8'), salt=base64.b64decode(salt),
+            n=int(n), r=int(r), p=int(p), dklen=len(expected),
+        )
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(digest, expected)
+
 class LocalAuthService:
     """Local authentication service using JSON credentials file"""
     
     def __init__(self):
         self.users = []
+        self._by_id: Dict[int, Dict] = {}
+        self._by_username: Dict[str, Dict] = {}
+        self._by_email: Dict[str, Dict] = {}
         self.load_users()
     
+    def _reindex(self):
+        """Rebuild the id/username/email lookups after self.users changes"""
+        # Built back to front so the first of any duplicates wins, as the
+        # linear scans they replace did
+        self._by_id = {u['id']: u for u in reversed(self.users)}
+        self._by_username = {u['username']: u for u in reversed(self.users)}
+        self._by_email = {u['email']: u for u in reversed(self.users) if 'email' in u}
+    
     def load_users(self):
         """Load users from the JSON credentials file"""
         try:
             if CREDENTIALS_FILE.exists():
-                with open(CREDENTIALS_FILE, 'r') as f:
-                    data = json.load(f)
+                with open(CREDENTIALS_FILE, 'rb') as f:
+                    data = orjson.loads(f.read())
                     self.users = data.get('users', [])
                     print(f"Loaded {len(self.users)} users from credentials file")
+                    self._warn_plaintext_passwords()
             else:
                 print(f"Credentials file not found at {CREDENTIALS_FILE}")
                 # Fallback to default users
@@ -30,9 +75,23 @@ class LocalAuthService:
         except Exception as e:
             print(f"Error loading users: {e}")
             self.users = self._get_default_users()
+        self._reindex()
+    
+    def _warn_plaintext_passwords(self):
+        """Report users whose stored password isn't a hash; they can't log in"""
+        for user in self.users:
+            if not str(user.get('password', '')).startswith(_HASH_PREFIX):
+                print(f"Warning: user {user.get('username')} has an unhashed password; reset it with update_user")
     
     def _get_default_users(self) -> List[Dict]:
         """Fallback default users if JSON file can't be loaded"""
+        users = self._default_user_records()
+        for user in users:
+            user['password'] = hash_password(user['password'])
+        return users
+    
+    def _default_user_records(self) -> List[Dict]:
+        """Default users with plaintext passwords, hashed by _get_default_users"""
         return [
             {
                 "id": 1,
@@ -117,9 +176,12 @@ class LocalAuthService:
         ]
     
     def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
-        """Authenticate a user with username and password"""
-        user = next((u for u in self.users if u['username'] == username and u['password'] == password), None)
-        if user:
+        """Authenticate a user with username and password
+        
+        Hashing is deliberately slow; call this off the event loop.
+        """
+        user = self._by_username.get(username)
+        if user and verify_password(user['password'], password):
             # Don't return the password in the user object
             user_copy = user.copy()
             user_copy.pop('password', None)
@@ -128,7 +190,7 @@ class LocalAuthService:
     
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
         """Get user by ID"""
-        user = next((u for u in self.users if u['id'] == user_id), None)
+        user = self._by_id.get(user_id)
         if user:
             user_copy = user.copy()
             user_copy.pop('password', None)
@@ -137,7 +199,7 @@ class LocalAuthService:
     
     def get_user_by_username(self, username: str) -> Optional[Dict]:
         """Get user by username"""
-        user = next((u for u in self.users if u['username'] == username), None)
+        user = self._by_username.get(username)
         if user:
             user_copy = user.copy()
             user_copy.pop('password', None)
@@ -147,25 +209,26 @@ class LocalAuthService:
     def create_user(self, user_data: Dict) -> Dict:
         """Create a new user"""
         # Check if username or email already exists
-        if any(u['username'] == user_data['username'] for u in self.users):
+        if user_data['username'] in self._by_username:
             raise ValueError("Username already exists")
         
-        if any(u['email'] == user_data['email'] for u in self.users):
+        if user_data['email'] in self._by_email:
             raise ValueError("Email already exists")
         
         # Generate new ID
-        new_id = max(u['id'] for u in self.users) + 1 if self.users else 1
+        new_id = max(self._by_id) + 1 if self._by_id else 1
         
         new_user = {
             "id": new_id,
             "username": user_data['username'],
-            "password": user_data['password'],
+            "password": hash_password(user_data['password']),
             "email": user_data['email'],
             "role": user_data.get('role', 'user'),
             "fullName": user_data['fullName']
         }
         
         self.users.append(new_user)
+        self._reindex()
         
         # Save to file
         self._save_users()
@@ -179,22 +242,23 @@ class LocalAuthService:
         """Save users to the JSON file"""
         try:
             data = {"users": self.users}
-            with open(CREDENTIALS_FILE, 'w') as f:
-                json.dump(data, f, indent=2)
+            with open(CREDENTIALS_FILE, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
             print(f"Users saved to {CREDENTIALS_FILE}")
         except Exception as e:
             print(f"Error saving users: {e}")
     
     def update_user(self, user_id: int, user_data: Dict) -> Optional[Dict]:
         """Update an existing user"""
-        user = next((u for u in self.users if u['id'] == user_id), None)
+        user = self._by_id.get(user_id)
         if not user:
             return None
         
         # Update fields
         for key, value in user_data.items():
             if key != 'id' and key in user:
-                user[key] = value
+                user[key] = hash_password(value) if key == 'password' else value
+        self._reindex()
         
         # Save to file
         self._save_users()
@@ -206,11 +270,12 @@ class LocalAuthService:
     
     def delete_user(self, user_id: int) -> bool:
         """Delete a user"""
-        user = next((u for u in self.users if u['id'] == user_id), None)
+        user = self._by_id.get(user_id)
         if not user:
             return False
         
         self.users.remove(user)
+        self._reindex()
         self._save_users()
         return True
     
@@ -224,12 +289,11 @@ auth_service = LocalAuthService()
 def require_local_auth(f):
     """Decorator to require local authentication"""
     @wraps(f)
-    def decorated_function(*args, **kwargs):
+    async def decorated_function(*args, **kwargs):
         # Get credentials from request headers or JSON body
         auth_header = request.headers.get('Authorization')
         
         if auth_header and auth_header.startswith('Basic '):
-            import base64
             try:
                 credentials = base64.b64decode(auth_header[6:]).decode('utf-8')
                 username, password = credentials.split(':', 1)
@@ -237,7 +301,7 @@ def require_local_auth(f):
                 return jsonify({"error": "Invalid authorization header"}), 401
         else:
             # Try to get from JSON body
-            data = request.get_json(silent=True) or {}
+            data = await request.get_json(silent=True) or {}
             username = data.get('username')
             password = data.get('password')
         
@@ -245,14 +309,14 @@ def require_local_auth(f):
             return jsonify({"error": "Username and password required"}), 401
         
         # Authenticate user
-        user = auth_service.authenticate_user(username, password)
+        user = await asyncio.to_thread(auth_service.authenticate_user, username, password)
         if not user:
             return jsonify({"error": "Invalid credentials"}), 401
         
         # Add user to request context
         request.current_user = user
         
-        return f(*args, **kwargs)
+        return await f(*args, **kwargs)
     
     return decorated_function
 
@@ -1,18 +1,15 @@
+import asyncio
+from functools import lru_cache
 from typing import Dict, Any, Optional
 import os
 
-from ..config import AppConfig
+import httpx
 
+from ..config import get_config
 
-def _compose_prompt(analysis: Dict[str, Any], weather: Optional[Dict[str, Any]], location: Optional[Dict[str, float]]):
-    # Extract soil analysis values for use as variables in the story
-    ph = analysis.get('pH', 'unknown')
-    organic_matter = analysis.get('OM') or analysis.get('organicMatter', 'unknown')
-    phosphorus = analysis.get('P', 'unknown')
-    electrical_conductivity = analysis.get('EC', 'unknown')
-    
-    # Build the detailed prompt with analysis values as variables
-    prompt = f"""You are a friendly soil health expert and storyteller who makes complex soil science accessible to everyone. Your job is to analyze the uploaded soil photo and create an engaging, easy-to-understand story that explains the soil's health and provides actionable gardening advice.
+
+# Story prompt with the analysis values left as format_map placeholders
+_TEMPLATE = """You are a friendly soil health expert and storyteller who makes complex soil science accessible to everyone. Your job is to analyze the uploaded soil photo and create an engaging, easy-to-understand story that explains the soil's health and provides actionable gardening advice.
 
 **Your Analysis Should Include:**
 1. **Soil Health Assessment:** Based on the photo, evaluate:
@@ -48,14 +45,34 @@ def _compose_prompt(analysis: Dict[str, Any], weather: Optional[Dict[str, Any]],
 
 **IMPORTANT: Use these actual analysis values in your story:**
 - pH: {ph}
-- Organic Matter: {organic_matter}
-- Phosphorus: {phosphorus}
-- Electrical Conductivity: {electrical_conductivity}
+- Organic Matter: {om}
+- Phosphorus: {p}
+- Electrical Conductivity: {ec}
 
 **Format the response as a cohesive, engaging story that feels like friendly advice from an experienced gardener neighbor. Aim for 200-300 words that are informative yet warm and encouraging.**
 
 Remember: The goal is to make soil science accessible and inspire confidence in the user's gardening abilities while providing practical, actionable advice they can implement right away."""
 
+
+@lru_cache(maxsize=1024)
+def _base_prompt(ph: Any, om: Any, p: Any, ec: Any) -> str:
+    # The same analysis regenerated reuses its prompt rather than rebuilding it
+    return _TEMPLATE.format_map({'ph': ph, 'om': om, 'p': p, 'ec': ec})
+
+
+def _compose_prompt(analysis: Dict[str, Any], weather: Optional[Dict[str, Any]], location: Optional[Dict[str, float]]):
+    # Extract soil analysis values for use as variables in the story
+    ph = analysis.get('pH', 'unknown')
+    organic_matter = analysis.get('OM') or analysis.get('organicMatter', 'unknown')
+    phosphorus = analysis.get('P', 'unknown')
+    electrical_conductivity = analysis.get('EC', 'unknown')
+    
+    # Fill the template with the analysis values
+    try:
+        prompt = _base_prompt(ph, organic_matter, phosphorus, electrical_conductivity)
+    except TypeError:  # Unhashable values can't be cached
+        prompt = _base_prompt.__wrapped__(ph, organic_matter, phosphorus, electrical_conductivity)
+    
     # Add weather and location context if available
     if weather:
         prompt += f"\n\nCurrent weather conditions: Temperature {weather.get('tempC', 'unknown')}°C, {weather.get('weather', 'unknown')} with humidity {weather.get('humidity', 'unknown')}%."
@@ -66,28 +83,44 @@ Remember: The goal is to make soil science accessible and inspire confidence in
     return prompt
 
 
-def generate_soil_story(analysis: Dict[str, Any], weather: Optional[Dict[str, Any]] = None, location: Optional[Dict[str, float]] = None) -> str:
+# Read once at import; the keys don't change while the process runs
+_CFG = get_config()
+
+# Upper bound on a single LLM call before falling back to the template story
+LLM_TIMEOUT = 60.0
+
+
+@lru_cache(maxsize=4)
+def _openai_client(http_client: Optional[httpx.AsyncClient]):
+    from openai import AsyncOpenAI
+    # Reuse the app's pooled HTTP client so calls share keep-alive connections
+    return AsyncOpenAI(api_key=_CFG.OPENAI_API_KEY, http_client=http_client, timeout=LLM_TIMEOUT)
+
+
+@lru_cache(maxsize=1)
+def _gemini_model():
+    import google.generativeai as genai
+    genai.configure(api_key=_CFG.GEMINI_API_KEY)
+    return genai.GenerativeModel("gemini-1.5-flash")
+
+
+async def generate_soil_story(analysis: Dict[str, Any], weather: Optional[Dict[str, Any]] = None, location: Optional[Dict[str, float]] = None,
+                              http_client: Optional[httpx.AsyncClient] = None) -> str:
     # Simple fallback deterministic template for offline use
     prompt = _compose_prompt(analysis, weather, location)
-    provider = 'openai' if AppConfig().OPENAI_API_KEY else ('gemini' if AppConfig().GEMINI_API_KEY else 'none')
+    provider = 'openai' if _CFG.OPENAI_API_KEY else ('gemini' if _CFG.GEMINI_API_KEY else 'none')
     try:
         if provider == 'openai':
-            from openai import OpenAI
-            client = OpenAI(api_key=AppConfig().OPENAI_API_KEY)
-            content = [
-                {"type": "text", "text": prompt}
-            ]
-            resp = client.chat.completions.create(
+            resp = await _openai_client(http_client).chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.7,
             )
             return (resp.choices[0].message.content or "").strip()
         if provider == 'gemini':
-            import google.generativeai as genai
-            genai.configure(api_key=AppConfig().GEMINI_API_KEY)
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            resp = model.generate_content(prompt)
+            resp = await asyncio.to_thread(
+                _gemini_model().generate_content, prompt, request_options={"timeout": LLM_TIMEOUT}
+            )
             return (resp.text or "").strip()
     except Exception:
         pass
@@ -1,76 +1,206 @@
+import hashlib
 import os
+import re
+import shutil
+import subprocess
+import threading
+import uuid
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from functools import lru_cache
 from pathlib import Path
-from typing import Tuple
+from typing import List, Optional, Tuple
 
-from PIL import Image
-from moviepy.editor import ImageClip, AudioFileClip, CompositeVideoClip
-try:
-    from moviepy.editor import TextClip
-    _HAS_TEXTCLIP = True
-except Exception:
-    _HAS_TEXTCLIP = False
+from PIL import Image, ImageDraw, ImageFont
 
-from ..config import AppConfig
+from ..config import get_config
 
 
-def _tts_to_file(text: str, out_path: Path) -> Path:
-    provider = AppConfig().TTS_PROVIDER
-    out_path.parent.mkdir(parents=True, exist_ok=True)
+# Chunk size for streaming media downloads to disk
+_COPY_CHUNK = 64 * 1024
+
+
+def _normalize_text(text: str) -> str:
+    # Case and whitespace don't change the narration or a remote model's video
+    return re.sub(r'\s+', ' ', text.strip().lower())
+
+
+def _tts_cache_key(text: str) -> str:
+    return hashlib.sha256(_normalize_text(text).encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=256)
+def _file_digest(path: str, mtime_ns: int, size: int) -> bytes:
+    # mtime and size are part of the key so a rewritten file is hashed again
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def _video_cache_key(story_text: str, image_path: str, model: str, normalize: bool = True) -> str:
+    # Captioned local videos show the text verbatim, so they key on it exactly
+    text = _normalize_text(story_text) if normalize else story_text
+    st = os.stat(image_path)
+    h = hashlib.sha256()
+    for part in (text.encode('utf-8'), _file_digest(image_path, st.st_mtime_ns, st.st_size), model.encode('utf-8')):
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+def _cached_video(media_dir: Path, tag: str, key: str) -> Tuple[Path, Optional[Tuple[str, str]]]:
+    """Return the video path for a cache key, and the result if it's already rendered"""
+    out_path = media_dir / f"{tag}_{key[:16]}.mp4"
+    try:
+        if out_path.stat().st_size > 0:
+            return out_path, (str(out_path), f"/media/{out_path.name}")
+    except FileNotFoundError:
+        pass
+    return out_path, None
+
+
+def _temp_video_path(out_path: Path) -> Path:
+    # Written here first and then renamed over out_path, so a crash or a
+    # concurrent job never leaves a truncated mp4 that looks like a cache hit
+    return out_path.with_name(f".{uuid.uuid4().hex}_{out_path.name}")
+
+
+def _evict_tts_cache(cache_dir: Path, max_bytes: int, keep: Path) -> None:
+    # Drop least recently used files (hits refresh mtime) until under the cap
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.mp3') and entry.path != str(keep):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries) + keep.stat().st_size
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _synthesize(text: str, provider: str, mp3_path: Path) -> None:
     if provider == 'gtts':
         from gtts import gTTS
         tts = gTTS(text=text)
-        mp3_path = out_path.with_suffix('.mp3')
         tts.save(str(mp3_path))
-        return mp3_path
-    elif provider == 'elevenlabs' and AppConfig().ELEVENLABS_API_KEY:
+    elif provider == 'elevenlabs':
         import requests
         headers = {
-            'xi-api-key': AppConfig().ELEVENLABS_API_KEY,
+            'xi-api-key': get_config().ELEVENLABS_API_KEY,
         }
         payload = {
             'text': text,
             'voice_settings': {"stability": 0.4, "similarity_boost": 0.8}
         }
-        resp = requests.post('https://api.elevenlabs.io/v1/text-to-speech/21m00Tcm4TlvDq8ikWAM', json=payload, headers=headers)
-        resp.raise_for_status()
-        mp3_path = out_path.with_suffix('.mp3')
-        with open(mp3_path, 'wb') as f:
-            f.write(resp.content)
-        return mp3_path
-    else:
-        # Fallback: simple beep (requires ffmpeg) - but try to still produce a file
-        mp3_path = out_path.with_suffix('.mp3')
-        with open(mp3_path, 'wb') as f:
-            f.write(b'')
-        return mp3_path
+        # Stream the audio to disk as it arrives rather than buffering it all
+        with requests.post('https://api.elevenlabs.io/v1/text-to-speech/21m00Tcm4TlvDq8ikWAM', json=payload, headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+            with open(mp3_path, 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=_COPY_CHUNK):
+                    f.write(chunk)
+
+
+def _tts_to_file(text: str) -> Optional[Path]:
+    """Synthesize narration for text, reusing an earlier synthesis of the same text
+
+    Audio is stored once per (text, provider) under MEDIA_DIR/tts_cache and
+    that path is returned. Returns None when no TTS provider is configured,
+    so the video is rendered silent.
+    """
+    cfg = get_config()
+    provider = cfg.TTS_PROVIDER
+    if provider == 'gtts' or (provider == 'elevenlabs' and cfg.ELEVENLABS_API_KEY):
+        cache_dir = Path(cfg.MEDIA_DIR) / 'tts_cache'
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        cache_path = cache_dir / f"{_tts_cache_key(text)}_{provider}.mp3"
+        try:
+            if cache_path.stat().st_size > 0:
+                os.utime(cache_path)  # Mark as recently used
+                return cache_path
+        except FileNotFoundError:
+            pass
+
+        # Synthesize to a private temp file and publish it atomically, so a
+        # concurrent job never reads a half-written cache entry
+        tmp_path = cache_dir / f".{uuid.uuid4().hex}.tmp"
+        try:
+            _synthesize(text, provider, tmp_path)
+            os.replace(tmp_path, cache_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        _evict_tts_cache(cache_dir, cfg.TTS_CACHE_MAX_MB * 1024 * 1024, keep=cache_path)
+        return cache_path
+    # No provider configured: no narration
+    return None
+
+
+# Model handles are built once per worker process and config, so Vertex AI
+# initialization, credential loading and model lookups aren't repeated for
+# every video; failures aren't cached and are retried on the next call
+
+@lru_cache(maxsize=4)
+def _google_credentials(path: str, mtime_ns: int):
+    # One credentials object per key file version (mtime is in the key so a
+    # rotated file is reloaded); google-auth keeps its access token in it and
+    # only fetches a new one as that nears expiry
+    import google.auth
+    credentials, _ = google.auth.load_credentials_from_file(
+        path, scopes=['https://www.googleapis.com/auth/cloud-platform']
+    )
+    return credentials
+
+
+@lru_cache(maxsize=4)
+def _veo_model(project: str, location: str, model_name: str, credentials_path: str, credentials_mtime_ns: int):
+    # Lazy import to avoid dependency unless configured
+    from vertexai.preview.vision_models import VideoGenerationModel
+    import vertexai
+    # Explicit credentials so Vertex AI doesn't rediscover and re-authenticate
+    vertexai.init(project=project, location=location,
+                  credentials=_google_credentials(credentials_path, credentials_mtime_ns))
+    return VideoGenerationModel.from_pretrained(model_name)
+
+
+@lru_cache(maxsize=4)
+def _gemini_video_model(api_key: str, model_name: str):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
 
 
 def _generate_with_veo(story_text: str, image_path: str) -> Tuple[str, str]:
     """Generate video using Google Veo via Vertex AI.
     Returns tuple of (local_video_path, public_url_or_local_route).
     """
-    cfg = AppConfig()
+    cfg = get_config()
+    cfg_media = Path(cfg.MEDIA_DIR)
+    cfg_media.mkdir(parents=True, exist_ok=True)
+    out_path, cached = _cached_video(cfg_media, 'veo', _video_cache_key(story_text, image_path, f"veo:{cfg.VEO_MODEL_NAME}"))
+    if cached:
+        return cached
     
     # Check if Veo is properly configured
     if not cfg.GCP_PROJECT_ID or not cfg.GOOGLE_APPLICATION_CREDENTIALS:
         raise RuntimeError("Veo not properly configured. GCP_PROJECT_ID and GOOGLE_APPLICATION_CREDENTIALS required.")
     
-    # Lazy import to avoid dependency unless configured
     try:
-        from vertexai.preview.vision_models import VideoGenerationModel
-        import vertexai
+        credentials_mtime_ns = os.stat(cfg.GOOGLE_APPLICATION_CREDENTIALS).st_mtime_ns
+        model = _veo_model(cfg.GCP_PROJECT_ID, cfg.GCP_LOCATION, cfg.VEO_MODEL_NAME,
+                           cfg.GOOGLE_APPLICATION_CREDENTIALS, credentials_mtime_ns)
     except ImportError:
         raise RuntimeError("Veo dependencies not available. Install google-cloud-aiplatform>=1.64.0")
     except Exception as e:
         raise RuntimeError(f"Veo initialization failed: {e}")
 
-    # Initialize Vertex AI
-    vertexai.init(project=cfg.GCP_PROJECT_ID, location=cfg.GCP_LOCATION)
-
     # Basic prompt combining story and hint about style
     prompt = f"Narrative: {story_text}\nGenerate a short 720p video suitable for gardening tips, with calm pacing."
 
-    model = VideoGenerationModel.from_pretrained(cfg.VEO_MODEL_NAME)
     # Veo can accept image conditioning; pass the uploaded image as a reference frame
     try:
         result = model.generate(
@@ -83,26 +213,27 @@ def _generate_with_veo(story_text: str, image_path: str) -> Tuple[str, str]:
     except Exception as e:
         raise RuntimeError(f"Veo generation failed: {e}")
 
-    cfg_media = Path(cfg.MEDIA_DIR)
-    cfg_media.mkdir(parents=True, exist_ok=True)
-    out_path = cfg_media / f"veo_{Path(image_path).stem}.mp4"
+    tmp_path = _temp_video_path(out_path)
     # result can be bytes or an object with .save; handle both
     try:
         if hasattr(result, 'save'):
-            result.save(str(out_path))
+            result.save(str(tmp_path))
         elif isinstance(result, (bytes, bytearray)):
-            with open(out_path, 'wb') as f:
+            with open(tmp_path, 'wb') as f:
                 f.write(result)
         else:
             # Fallback if result has .media or similar
             content = getattr(result, 'media', None)
             if content:
-                with open(out_path, 'wb') as f:
+                with open(tmp_path, 'wb') as f:
                     f.write(content)
             else:
                 raise RuntimeError('Unexpected Veo result type')
+        os.replace(tmp_path, out_path)
     except Exception as e:
         raise RuntimeError(f"Saving Veo output failed: {e}")
+    finally:
+        tmp_path.unlink(missing_ok=True)
 
     public_url = f"/media/{out_path.name}"
     return str(out_path), public_url
@@ -112,14 +243,18 @@ def _generate_with_gemini(story_text: str, image_path: str) -> Tuple[str, str]:
     """Generate video using Gemini via Google AI Studio API.
     Returns tuple of (local_video_path, public_url_or_local_route).
     """
-    cfg = AppConfig()
+    cfg = get_config()
+    cfg_media = Path(cfg.MEDIA_DIR)
+    cfg_media.mkdir(parents=True, exist_ok=True)
+    out_path, cached = _cached_video(cfg_media, 'gemini', _video_cache_key(story_text, image_path, f"gemini:{cfg.GEMINI_VIDEO_MODEL}"))
+    if cached:
+        return cached
+    
     if not cfg.GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY not set for Gemini video generation")
     
     try:
-        import google.generativeai as genai
-        genai.configure(api_key=cfg.GEMINI_API_KEY)
-        model = genai.GenerativeModel(cfg.GEMINI_VIDEO_MODEL)
+        model = _gemini_video_model(cfg.GEMINI_API_KEY, cfg.GEMINI_VIDEO_MODEL)
     except ImportError:
         raise RuntimeError("Gemini dependencies not available. Install google-generativeai")
     except Exception as e:
@@ -158,17 +293,18 @@ def _generate_with_gemini(story_text: str, image_path: str) -> Tuple[str, str]:
             raise RuntimeError("Unexpected Gemini response format")
         
         # Save video to local storage
-        cfg_media = Path(cfg.MEDIA_DIR)
-        cfg_media.mkdir(parents=True, exist_ok=True)
-        out_path = cfg_media / f"gemini_{Path(image_path).stem}.mp4"
-        
-        if isinstance(video_data, bytes):
-            with open(out_path, 'wb') as f:
-                f.write(video_data)
-        else:
-            # If it's a file-like object
-            with open(out_path, 'wb') as f:
-                f.write(video_data.read())
+        tmp_path = _temp_video_path(out_path)
+        try:
+            if isinstance(video_data, bytes):
+                with open(tmp_path, 'wb') as f:
+                    f.write(video_data)
+            else:
+                # If it's a file-like object, copy it across in chunks
+                with open(tmp_path, 'wb') as f:
+                    shutil.copyfileobj(video_data, f, _COPY_CHUNK)
+            os.replace(tmp_path, out_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
         
         public_url = f"/media/{out_path.name}"
         return str(out_path), public_url
@@ -177,83 +313,210 @@ def _generate_with_gemini(story_text: str, image_path: str) -> Tuple[str, str]:
         raise RuntimeError(f"Gemini video generation failed: {e}")
 
 
+@lru_cache(maxsize=1)
+def _ffmpeg_exe() -> str:
+    # The binary bundled with imageio-ffmpeg (installed with moviepy), else PATH
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which('ffmpeg') or 'ffmpeg'
+
+
+def _encode_still_video(image_path: str, audio_file: Optional[Path], duration: float, out_path: Path) -> None:
+    """Encode a still image (and narration) to mp4 with one ffmpeg call
+
+    The image is fed as a 1 fps loop and x264 is tuned for still images, so
+    only a frame per second is encoded instead of compositing 24 in Python.
+    """
+    cmd = [_ffmpeg_exe(), '-y', '-loglevel', 'error', '-loop', '1', '-framerate', '1', '-i', image_path]
+    if audio_file is not None:
+        cmd += ['-i', str(audio_file)]
+    cmd += [
+        '-t', f"{duration:.3f}",
+        # yuv420p needs even dimensions
+        '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+        '-c:v', 'libx264', '-tune', 'stillimage', '-pix_fmt', 'yuv420p',
+    ]
+    if audio_file is not None:
+        cmd += ['-c:a', 'aac']
+    cmd += ['-movflags', '+faststart', str(out_path)]
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+
+
+# Largest frame local videos are rendered at; bigger photos are shrunk once
+# up front instead of being scaled on every frame
+VIDEO_FRAME_SIZE = (1280, 720)
+
+# Caption text: white, 32px, wrapped to the frame width less a 50px margin
+# each side and starting 65% of the way down, as the old TextClip overlay was
+CAPTION_FONT_SIZE = 32
+CAPTION_MARGIN = 50
+_CAPTION_FONTS = ('DejaVuSans.ttf', 'Arial.ttf', 'LiberationSans-Regular.ttf')
+
+
+@lru_cache(maxsize=1)
+def _caption_font() -> ImageFont.FreeTypeFont:
+    for name in _CAPTION_FONTS:
+        try:
+            return ImageFont.truetype(name, CAPTION_FONT_SIZE)
+        except OSError:
+            continue
+    # Pillow's bundled scalable font
+    return ImageFont.load_default(size=CAPTION_FONT_SIZE)
+
+
+def _wrap_caption(draw: ImageDraw.ImageDraw, text: str, font, max_width: int) -> List[str]:
+    # Greedy word wrap on rendered width rather than character count
+    lines: List[str] = []
+    line = ''
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if line and draw.textlength(candidate, font=font) > max_width:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _draw_caption(frame: Image.Image, text: str) -> None:
+    draw = ImageDraw.Draw(frame)
+    font = _caption_font()
+    lines = _wrap_caption(draw, text, font, frame.width - 2 * CAPTION_MARGIN)
+    # Lines running past the bottom edge are cropped, as with the overlay
+    draw.multiline_text((CAPTION_MARGIN, int(frame.height * 0.65)), "\n".join(lines), font=font, fill='white')
+
+
+def _video_frame(image_path: str, out_path: Path, caption: Optional[str] = None) -> Optional[Path]:
+    """Write the video's single frame to out_path: the image fit to
+    VIDEO_FRAME_SIZE, with the caption drawn on it
+
+    Returns None when the image already fits and there's no caption, so it
+    can be used as is.
+    """
+    with Image.open(image_path) as img:
+        fits = img.width <= VIDEO_FRAME_SIZE[0] and img.height <= VIDEO_FRAME_SIZE[1]
+        if fits and not caption:
+            return None
+        if not fits:
+            # JPEGs decode straight to a reduced DCT scale that still covers the frame
+            img.draft('RGB', VIDEO_FRAME_SIZE)
+            img.thumbnail(VIDEO_FRAME_SIZE, Image.LANCZOS)
+        frame = img.convert('RGB')
+    if caption:
+        _draw_caption(frame, caption)
+    frame.save(out_path, format='JPEG', quality=85)
+    return out_path
+
+
 def _generate_local_video(story_text: str, image_path: str) -> Tuple[str, str]:
-    """Generate video using local TTS + moviepy method.
+    """Generate video using local TTS + ffmpeg method.
     Returns tuple of (local_video_path, public_url_or_local_route).
     """
-    cfg = AppConfig()
+    cfg = get_config()
     media_dir = Path(cfg.MEDIA_DIR)
     media_dir.mkdir(parents=True, exist_ok=True)
+    video_path, cached = _cached_video(media_dir, 'story', _video_cache_key(story_text, image_path, f"local:{cfg.TTS_PROVIDER}", normalize=False))
+    if cached:
+        return cached
 
     base_name = f"story_{os.path.splitext(os.path.basename(image_path))[0]}"
-    audio_path = media_dir / f"{base_name}_audio"
-    audio_file = _tts_to_file(story_text, audio_path)
+    narration = _tts_to_file(story_text)
 
-    # Build simple video: static image with audio; add captions as overlay text
-    img_clip = ImageClip(image_path).set_duration(max(6, len(story_text.split()) / 2.5))
-    narration = AudioFileClip(str(audio_file)) if os.path.getsize(audio_file) > 0 else None
-    if narration:
-        img_clip = img_clip.set_audio(narration)
+    # Build simple video: static image with audio and the caption drawn on
+    # it once, so ffmpeg only has to loop a single frame
+    duration = max(6, len(story_text.split()) / 2.5)
+    frame_path = _video_frame(image_path, media_dir / f".{uuid.uuid4().hex}_{base_name}_frame.jpg", caption=story_text)
 
-    layers = [img_clip]
-    if _HAS_TEXTCLIP:
-        try:
-            caption = TextClip(story_text, fontsize=32, color='white', method='caption', align='West', size=(img_clip.w - 100, None))
-            caption = caption.set_duration(img_clip.duration).set_position((50, img_clip.h*0.65))
-            layers.append(caption)
-        except Exception:
-            pass
-
-    final = CompositeVideoClip(layers)
-    video_path = media_dir / f"{base_name}.mp4"
-    final.write_videofile(str(video_path), fps=24)
+    tmp_path = _temp_video_path(video_path)
+    try:
+        _encode_still_video(str(frame_path or image_path), narration, duration, tmp_path)
+        os.replace(tmp_path, video_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        if frame_path:
+            frame_path.unlink(missing_ok=True)
 
     public_url = f"/media/{video_path.name}"
     return str(video_path), public_url
 
 
+def _start_remote(remote, story_text: str, image_path: str) -> Future:
+    """Run a remote provider on its own daemon thread
+
+    Each job gets a throwaway thread, so a slow provider never holds up
+    other jobs and never keeps the process alive at shutdown.
+    """
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(remote(story_text, image_path))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='video-remote', daemon=True).start()
+    return future
+
+
+def _generate_hedged(remote, story_text: str, image_path: str, hedge_after: float) -> Tuple[str, str]:
+    """Run a remote provider, generating locally too if it's slow
+
+    The local fallback runs in the calling thread. If it succeeds it wins;
+    the remote call can't be interrupted mid-call, and if it finishes later
+    its output only lands in the video cache. If it fails, the remote
+    result is awaited instead.
+    """
+    remote_future = _start_remote(remote, story_text, image_path)
+    try:
+        return remote_future.result(timeout=hedge_after)
+    except FuturesTimeoutError:
+        print(f"⏱️  No video after {hedge_after:g}s, starting local generation alongside...")
+    except Exception as e:
+        print(f"⚠️  Video generation with {remote.__name__} failed: {e}")
+        print("🔄 Falling back to local video generation...")
+        return _generate_local_video(story_text, image_path)
+
+    try:
+        return _generate_local_video(story_text, image_path)
+    except Exception as e:
+        print(f"⚠️  Local video generation failed: {e}, waiting for {remote.__name__}...")
+        return remote_future.result()
+
+
 def generate_story_video(story_text: str, image_path: str) -> Tuple[str, str]:
     """Generate a story video using the configured provider.
     Returns tuple of (local_video_path, public_url_or_local_route).
     """
-    cfg = AppConfig()
+    cfg = get_config()
     provider = cfg.VIDEO_PROVIDER.lower() if cfg.VIDEO_PROVIDER else 'gemini'
     
     print(f"🎬 Generating video with provider: {provider}")
     
-    try:
-        # Try Gemini first (default and most reliable)
-        if provider in ['gemini', 'default', '']:
-            print("🎬 Attempting Gemini video generation...")
-            return _generate_with_gemini(story_text, image_path)
-        
-        # Try Veo if specifically requested and configured
-        elif provider == 'veo':
-            print("🎬 Attempting Veo video generation...")
-            return _generate_with_veo(story_text, image_path)
-        
-        # Fallback to local generation
-        elif provider == 'local':
-            print("🎬 Using local video generation...")
+    if provider == 'local':
+        print("🎬 Using local video generation...")
+        try:
             return _generate_local_video(story_text, image_path)
-        
-        # Unknown provider, fallback to Gemini
-        else:
+        except Exception as e:
+            raise RuntimeError(f"Video generation failed: {e}")
+    
+    # Try Veo if specifically requested, otherwise Gemini (the default,
+    # and the fallback for unknown providers)
+    if provider == 'veo':
+        print("🎬 Attempting Veo video generation...")
+        remote = _generate_with_veo
+    else:
+        if provider not in ['gemini', 'default', '']:
             print(f"🎬 Unknown provider '{provider}', falling back to Gemini...")
-            return _generate_with_gemini(story_text, image_path)
-            
+        print("🎬 Attempting Gemini video generation...")
+        remote = _generate_with_gemini
+    
+    try:
+        return _generate_hedged(remote, story_text, image_path, cfg.VIDEO_HEDGE_SECONDS)
     except Exception as e:
-        print(f"⚠️  Video generation with {provider} failed: {e}")
-        
-        # Fallback chain: try other providers if the primary one fails
-        if provider != 'local':
-            try:
-                print("🔄 Falling back to local video generation...")
-                return _generate_local_video(story_text, image_path)
-            except Exception as local_error:
-                print(f"❌ Local video generation also failed: {local_error}")
-                raise RuntimeError(f"All video generation methods failed. Last error: {local_error}")
-        else:
-            raise RuntimeError(f"Video generation failed: {e}")
-
-
+        print(f"❌ Remote and local video generation both failed: {e}")
+        raise RuntimeError(f"All video generation methods failed. Last error: {e}")
@@ -1,13 +1,59 @@
+import asyncio
 import os
-from typing import Optional, Dict, Any
-import requests
-from ..config import AppConfig
+import threading
+from typing import Optional, Dict, Any, Tuple
+import httpx
+from cachetools import TTLCache
+from ..config import get_config
 
 
-def fetch_weather_snapshot(lat: float, lon: float) -> Optional[Dict[str, Any]]:
-    key = AppConfig().WEATHER_API_KEY
+# Snapshots keyed by (lat, lon) rounded to 0.1 degrees (~11 km) plus language,
+# so nearby uploads within ten minutes share one OpenWeather call.
+_WEATHER_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=600)
+_WEATHER_CACHE_LOCK = threading.Lock()
+
+
+# Lookups currently waiting on OpenWeather, so concurrent misses for the
+# same cache key share one request instead of each making their own
+_IN_FLIGHT: Dict[Tuple[float, float, Optional[str]], asyncio.Future] = {}
+
+
+async def fetch_weather_snapshot(lat: float, lon: float, client: Optional[httpx.AsyncClient] = None) -> Optional[Dict[str, Any]]:
+    key = get_config().WEATHER_API_KEY
     if not key:
         return None
+    lang = os.environ.get('WEATHER_LANG')
+    cache_key = (round(lat, 1), round(lon, 1), lang)
+    with _WEATHER_CACHE_LOCK:
+        cached = _WEATHER_CACHE.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
+    task = _IN_FLIGHT.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_cache(cache_key, client, key, lat, lon, lang))
+        _IN_FLIGHT[cache_key] = task
+        task.add_done_callback(lambda _: _IN_FLIGHT.pop(cache_key, None))
+    # Shielded so one caller going away doesn't cancel the others' lookup
+    snapshot = await asyncio.shield(task)
+    return dict(snapshot) if snapshot is not None else None
+
+
+async def _fetch_and_cache(cache_key: Tuple[float, float, Optional[str]], client: Optional[httpx.AsyncClient],
+                           key: str, lat: float, lon: float, lang: Optional[str]) -> Optional[Dict[str, Any]]:
+    if client is None:
+        async with httpx.AsyncClient(timeout=10) as own_client:
+            snapshot = await _fetch_weather(own_client, key, lat, lon, lang)
+    else:
+        snapshot = await _fetch_weather(client, key, lat, lon, lang)
+    # Failures are not cached so the next request retries the API
+    if snapshot is not None:
+        with _WEATHER_CACHE_LOCK:
+            _WEATHER_CACHE[cache_key] = snapshot
+    return snapshot
+
+
+async def _fetch_weather(client: httpx.AsyncClient, key: str, lat: float, lon: float, lang: Optional[str]) -> Optional[Dict[str, Any]]:
     try:
         # Current Weather API v2.5 (as per provided docs)
         params = {
@@ -17,11 +63,10 @@ def fetch_weather_snapshot(lat: float, lon: float) -> Optional[Dict[str, Any]]:
             'units': 'metric',
         }
         # Optional language via env
-        lang = os.environ.get('WEATHER_LANG')
         if lang:
             params['lang'] = lang
 
-        resp = requests.get('https://api.openweathermap.org/data/2.5/weather', params=params, timeout=10)
+        resp = await client.get('https://api.openweathermap.org/data/2.5/weather', params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
 
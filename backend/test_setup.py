@@ -1,19 +1,58 @@
 import os
+import re
 import sys
-import importlib.util
+import importlib.metadata
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 
+# Read .env once for all of the checks below
+load_dotenv()
+
+def _normalize(name):
+    # Distribution names compare case-insensitively with -, _ and . equivalent
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+@lru_cache(maxsize=1)
+def _installed_distributions():
+    """Names of every installed distribution, read from metadata in one scan"""
+    return {
+        _normalize(dist.metadata["Name"])
+        for dist in importlib.metadata.distributions()
+        if dist.metadata["Name"]
+    }
+
 def check_module(module_name):
-    """Check if a Python module is installed"""
-    return importlib.util.find_spec(module_name) is not None
+    """Check if a Python package is installed, by its distribution name"""
+    return _normalize(module_name) in _installed_distributions()
 
 def check_env_file():
     """Check if .env file exists"""
     return os.path.exists(".env")
 
+def find_missing_dirs(directories):
+    """Return the directories that don't exist
+    
+    Each parent is listed once with scandir rather than stat-ing every path.
+    """
+    listings = {}
+    
+    def subdirs(parent):
+        if parent not in listings:
+            try:
+                with os.scandir(parent) as entries:
+                    listings[parent] = {entry.name for entry in entries if entry.is_dir()}
+            except OSError:  # The parent itself is missing
+                listings[parent] = set()
+        return listings[parent]
+    
+    return [
+        directory for directory in directories
+        if os.path.basename(directory) not in subdirs(os.path.dirname(directory) or ".")
+    ]
+
 def check_firebase_config():
     """Check if Firebase configuration is set up"""
-    load_dotenv()
     required_vars = [
         "FIREBASE_API_KEY",
         "FIREBASE_AUTH_DOMAIN",
@@ -38,7 +77,6 @@ def check_firebase_config():
 
 def check_ai_config():
     """Check if AI service configuration is set up"""
-    load_dotenv()
     ai_provider = os.getenv("AI_SERVICE_PROVIDER", "").lower()
     
     if ai_provider == "openai":
@@ -79,10 +117,27 @@ def main():
         "pillow"
     ]
     
-    missing_packages = []
-    for package in required_packages:
-        if not check_module(package.replace("-", "_")):
-            missing_packages.append(package)
+    # Check directory structure
+    required_dirs = [
+        "app",
+        "app/core",
+        "app/routers",
+        "app/schemas",
+        "app/services",
+        "app/utils"
+    ]
+    
+    # The package, .env and directory checks only touch the filesystem and
+    # don't print, so run them side by side and report in order below
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        packages_future = executor.submit(_installed_distributions)
+        env_future = executor.submit(check_env_file)
+        dirs_future = executor.submit(find_missing_dirs, required_dirs)
+        packages_future.result()
+        env_file_found = env_future.result()
+        missing_dirs = dirs_future.result()
+    
+    missing_packages = [package for package in required_packages if not check_module(package)]
     
     if missing_packages:
         print(f"❌ Missing required packages: {', '.join(missing_packages)}")
@@ -91,13 +146,14 @@ def main():
         print("✅ All required packages installed")
     
     # Check .env file
-    if check_env_file():
+    if env_file_found:
         print("✅ .env file found")
     else:
         print("❌ .env file not found. Copy .env.example to .env and fill in your credentials.")
     
     # Check Firebase configuration
-    if check_firebase_config():
+    firebase_ok = check_firebase_config()
+    if firebase_ok:
         print("✅ Firebase configuration OK")
     else:
         print("❌ Firebase configuration incomplete")
@@ -108,21 +164,6 @@ def main():
     else:
         print("⚠️ AI service configuration incomplete (will use simulated results)")
     
-    # Check directory structure
-    required_dirs = [
-        "app",
-        "app/core",
-        "app/routers",
-        "app/schemas",
-        "app/services",
-        "app/utils"
-    ]
-    
-    missing_dirs = []
-    for directory in required_dirs:
-        if not os.path.exists(directory):
-            missing_dirs.append(directory)
-    
     if missing_dirs:
         print(f"❌ Missing required directories: {', '.join(missing_dirs)}")
     else:
@@ -131,7 +172,7 @@ def main():
     print("\n🔍 Setup check complete!")
     
     # Summary
-    if not missing_packages and check_env_file() and check_firebase_config() and not missing_dirs:
+    if not missing_packages and env_file_found and firebase_ok and not missing_dirs:
         print("\n✅ Your SoilStory API is ready to run!")
         print("   Start the server with: python main.py")
         print("   Or: uvicorn main:app --reload")
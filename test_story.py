@@ -3,6 +3,8 @@
 Test script for the updated story generation service
 """
 
+import asyncio
+import re
 import sys
 import os
 sys.path.append('backend')
@@ -50,44 +52,30 @@ def test_story_generation():
     
     try:
         # Generate story with the new detailed prompt
-        story = generate_soil_story(
+        story = asyncio.run(generate_soil_story(
             analysis=sample_analysis,
             weather=sample_weather,
             location=sample_location
-        )
+        ))
         
         print("\nGenerated Story:")
         print("-" * 30)
         print(story)
         print("-" * 30)
         
-        # Check if the analysis values are included in the story
-        story_lower = story.lower()
-        analysis_values_found = []
-        
-        if str(sample_analysis['pH']) in story:
-            analysis_values_found.append(f"pH: {sample_analysis['pH']}")
-        if str(sample_analysis['OM']) in story:
-            analysis_values_found.append(f"OM: {sample_analysis['OM']}")
-        if str(sample_analysis['P']) in story:
-            analysis_values_found.append(f"P: {sample_analysis['P']}")
-        if str(sample_analysis['EC']) in story:
-            analysis_values_found.append(f"EC: {sample_analysis['EC']}")
+        # Check if the analysis values are included in the story, finding
+        # all four in one pass over the text
+        keys = ['pH', 'OM', 'P', 'EC']
+        pattern = re.compile('|'.join(f"(?P<{key}>{re.escape(str(sample_analysis[key]))})" for key in keys))
+        found = {match.lastgroup for match in pattern.finditer(story)}
+        analysis_values_found = [f"{key}: {sample_analysis[key]}" for key in keys if key in found]
         
         print(f"\nAnalysis Values Found in Story: {len(analysis_values_found)}/4")
         for value in analysis_values_found:
             print(f"  ✓ {value}")
         
         if len(analysis_values_found) < 4:
-            missing = []
-            if str(sample_analysis['pH']) not in story:
-                missing.append(f"pH: {sample_analysis['pH']}")
-            if str(sample_analysis['OM']) not in story:
-                missing.append(f"OM: {sample_analysis['OM']}")
-            if str(sample_analysis['P']) not in story:
-                missing.append(f"P: {sample_analysis['P']}")
-            if str(sample_analysis['EC']) not in story:
-                missing.append(f"EC: {sample_analysis['EC']}")
+            missing = [f"{key}: {sample_analysis[key]}" for key in keys if key not in found]
             print(f"\nMissing Values:")
             for value in missing:
                 print(f"  ✗ {value}")